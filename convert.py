@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Author: i2cy(i2cy@outlook.com)
+# Project: sources
+# Filename: convert
+# Created on: 2026/10/18
+
+"""
+无界面批量格式转换工具，在 chn/mca/txt/tch/tps 之间转换整个目录树
+
+用法示例:
+    python convert.py 原始目录 输出目录 -f mca
+    python convert.py 原始目录 输出目录 -f tps --timed --workers 8
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from modules.mca import MCA, VERIFY_CACHE
+
+SUPPORTED_FORMATS = ("chn", "mca", "txt", "tch", "tps")
+
+
+def init_worker():
+    """
+    转换进程初始化：校验记录不在子进程中保存，随结果交给主进程统一写入
+    """
+    VERIFY_CACHE.autosave = False
+
+
+def file_seed(seed, relpath):
+    """
+    由 --seed 与源文件相对路径派生该文件的随机种子，各文件的脉冲序列互不相关，
+    且与文件的转换顺序、进程数及目录中其他文件无关
+
+    :param seed: int, 命令行给出的随机种子，为None时返回None（随机）
+    :param relpath: str, 源文件相对源目录的路径
+    :return: list of int，可直接用于 np.random.SeedSequence
+    """
+    if seed is None:
+        return None
+    digest = hashlib.sha256(relpath.replace(os.sep, "/").encode("utf-8")).digest()
+    return [seed, int().from_bytes(digest[:8], "little")]
+
+
+def convert_file(src, dst, fmt, timed=False, seed=None):
+    """
+    转换单个文件
+
+    :param src: str, 源文件
+    :param dst: str, 目标文件
+    :param fmt: str, 目标格式
+    :param timed: bool, 转换为tps时是否附带时间间隔
+    :param seed: int / list of int, 转换为tps时的随机种子，见 file_seed
+    :return: (str src, str dst, int 读取字节数, int 写入字节数, dict 本次新增的校验记录)
+    """
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+
+    if fmt == "tps" and os.path.splitext(src)[1].lower() == ".tps":
+        # 已是核脉冲文件，直接复制，不用重新抽样的脉冲替换真实脉冲
+        shutil.copyfile(src, dst)
+        return src, dst, os.path.getsize(src), os.path.getsize(dst), {}
+
+    mca = MCA(src, verify="trust")
+
+    if fmt == "tps":
+        total_time = mca.total_time if mca.total_time else 1
+        written = mca.to_pulse_file(dst,
+                                    csp_rate=mca.sum() / total_time,
+                                    total_time=total_time,
+                                    timed=timed,
+                                    seed=seed,
+                                    total_pulses=int(mca.sum()))
+    else:
+        written = mca.to_file(dst)
+
+    return src, dst, os.path.getsize(src), written, VERIFY_CACHE.pop_pending()
+
+
+def find_files(src_dir, formats=SUPPORTED_FORMATS):
+    """
+    递归查找目录下所有支持的文件
+
+    :param src_dir: str, 源目录
+    :param formats: tuple, 需要转换的源文件格式
+    :return: list of str
+    """
+    ret = []
+    for root, dirs, files in os.walk(src_dir):
+        dirs.sort()
+        for ele in sorted(files):
+            if ele.split(".")[-1].lower() in formats:
+                ret.append(os.path.join(root, ele))
+    return ret
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pucleus 能谱/核脉冲文件批量格式转换")
+    parser.add_argument("src", help="源文件目录")
+    parser.add_argument("dst", help="输出目录，保持与源目录相同的目录结构")
+    parser.add_argument("-f", "--format", required=True, choices=SUPPORTED_FORMATS,
+                        help="目标格式")
+    parser.add_argument("-i", "--input-formats", default=",".join(SUPPORTED_FORMATS),
+                        help="需要转换的源文件格式，逗号分隔，默认全部")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="进程数，默认使用全部CPU核心")
+    parser.add_argument("--timed", action="store_true",
+                        help="转换为tps时附带脉冲时间间隔")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="转换为tps时的随机种子，每个文件使用由该种子与文件相对路径"
+                             "派生的 SeedSequence([seed, sha256(相对路径)前8字节])")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="覆盖已存在的目标文件")
+    args = parser.parse_args(argv)
+
+    formats = tuple(ele.strip().lower() for ele in args.input_formats.split(",") if ele.strip())
+    tasks = []
+    for src in find_files(args.src, formats):
+        dst = os.path.relpath(src, args.src)
+        dst = os.path.join(args.dst, os.path.splitext(dst)[0] + "." + args.format)
+        if os.path.exists(dst) and not args.overwrite:
+            continue
+        tasks.append((src, dst, file_seed(args.seed, os.path.relpath(src, args.src))))
+
+    if not tasks:
+        print("[转换] 没有需要转换的文件")
+        return 0
+
+    total = len(tasks)
+    done = 0
+    failed = 0
+    bytes_in = 0
+    bytes_out = 0
+    t0 = time.time()
+    print("[转换] 共 {} 个文件待转换为 {}".format(total, args.format))
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor, VERIFY_CACHE.hold():
+        futures = {executor.submit(convert_file, src, dst, args.format, args.timed, seed): src
+                   for src, dst, seed in tasks}
+        for future in as_completed(futures):
+            done += 1
+            try:
+                src, dst, size_in, size_out, verified = future.result()
+                VERIFY_CACHE.merge(verified)
+                bytes_in += size_in
+                bytes_out += size_out
+                print("[转换] [{}/{}] {} -> {}".format(done, total, src, dst))
+            except Exception as err:
+                failed += 1
+                print("[转换] [{}/{}] {} 转换失败: {}".format(done, total, futures[future], err),
+                      file=sys.stderr)
+
+    dt = max(time.time() - t0, 1e-6)
+    print("[转换] 完成 {} 个，失败 {} 个，用时 {:.2f} s，{:.1f} 文件/s，读取 {:.2f} MB/s，写入 {:.2f} MB/s".format(
+        total - failed, failed, dt, total / dt, bytes_in / dt / 2 ** 20, bytes_out / dt / 2 ** 20
+    ))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
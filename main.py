@@ -8,23 +8,25 @@
 
 import sys
 import os
+import multiprocessing
 import pyqtgraph as pg
 import numpy as np
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, \
     QSizePolicy, QListWidgetItem, QMessageBox
 from PyQt5.QtGui import QIcon, QImage, QPixmap, QKeyEvent, QMouseEvent, QPainterPath
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from pucleus_ui import Ui_MainWindow
 from modules.mca import MCA, Pulses
 from modules.utils import ColorManager, get_R_square, ModLogger, Mod_PlotWidget, ModTargetItem
 import modules.smooth as smooth
 from modules.energy_axis import linear_regression
 from modules.threads import PulseGenThread, UpdatePulseInfoThread
-from modules.find_peek import SimpleCompare, Peek, Derivative
+from modules.find_peek import SimpleCompare, Peek, Derivative, ContinuousWavelet
 from modules.libraries import Library, Nucleo
 
 
 class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
+    file_corrupted = pyqtSignal(str)
 
     def __init__(self, logger=None):
         if logger is None:
@@ -158,6 +160,8 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         self.setLayout(self.verticalLayout_pulse_gragh)
 
         self.pulse_plot = None
+        self.pulse_decimator = None
+        self.pulse_plot_window.plotItem.getViewBox().sigXRangeChanged.connect(self.on_pulse_view_changed)
 
         # pulse time graph init
         self.pulse_plot_time_window = Mod_PlotWidget(self)
@@ -172,6 +176,7 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         self.pulse_plot_time_window.plotItem.showAxes("right")
         self.pulse_plot_time_window.setBackground(None)
         self.pulse_plot_time_window.setMouseEnabled(False, False)
+        self.pulse_time_plot = None
         self.linearReg_plot = None
         self.linearReg_dots_plot = None
 
@@ -285,14 +290,15 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         self.K_energy_b = 0
 
         self.thread_pulse_generator = PulseGenThread(self)
-        self.thread_pulse_info_updater = UpdatePulseInfoThread(self)
+        self.pulse_gen_logged_decile = -1
+        self.thread_pulse_info_updater = self.static_new_pulse_info_updater()
+        self.threads_pulse_info_stale = []
 
         self.thread_pulse_generator.setParent(self)
-        self.thread_pulse_info_updater.setParent(self)
 
-        self.thread_pulse_info_updater.draw_pulse.connect(self.do_draw_pulse)
-        self.thread_pulse_info_updater.draw_pulse_time.connect(self.do_draw_pulse_time)
         self.thread_pulse_generator.open_later.connect(self.static_add_file)
+        self.thread_pulse_generator.progress.connect(self.on_pulse_gen_progress)
+        self.file_corrupted.connect(self.on_file_corrupted)
 
     def static_channel_2_energy(self, channel, a=None, b=None):
         if a is None:
@@ -413,9 +419,10 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         type = "MCA"
         pulse = None
 
-        if filename.split(".")[-1] == "tps":
+        if filename.split(".")[-1].lower() == "tps":
             type = "PUL"
-            pulse = Pulses(filename)
+            # 校验已由 mca_object 打开同一文件时完成或安排在后台进行
+            pulse = Pulses(filename, mmap=True, verify="none")
 
         filename = filename.split("/")[-1]
         filename = filename.split("\\")[-1]
@@ -590,9 +597,22 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         self.doubleSpinBox_pulse_csp_rate.setValue(csp_rate)
         self.doubleSpinBox_pulse_measure_time.setValue(total_time)
 
+    def static_new_pulse_info_updater(self):
+        thread = UpdatePulseInfoThread(self)
+        thread.setParent(self)
+        thread.draw_pulse.connect(self.do_draw_pulse)
+        thread.draw_pulse_time.connect(self.do_draw_pulse_time)
+
+        return thread
+
     def static_update_pulseInfo(self):
-        if not self.thread_pulse_info_updater.isFinished():
-            self.thread_pulse_info_updater.terminate()
+        if self.thread_pulse_info_updater.isRunning():
+            # 不在界面线程中等待旧线程，旧线程在下一块前退出，其已发出的结果在绘制时丢弃
+            stale = self.thread_pulse_info_updater
+            stale.requestInterruption()
+            self.threads_pulse_info_stale.append(stale)
+            stale.finished.connect(lambda: self.threads_pulse_info_stale.remove(stale))
+            self.thread_pulse_info_updater = self.static_new_pulse_info_updater()
         self.thread_pulse_info_updater.set_curve(self.static_get_current_curve())
         self.thread_pulse_info_updater.start()
 
@@ -618,6 +638,45 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
     def static_clear_pulseInfo(self):
         self.pulse_plot_window.clear()
         self.pulse_plot_time_window.clear()
+        self.pulse_plot = None
+        self.pulse_decimator = None
+
+    def static_release_pulse_file(self, filename):
+        """
+        关闭以内存映射方式打开了指定脉冲文件的列表项，并丢弃引用该映射的预览数据，
+        Windows 下映射中的文件无法被截断或删除，覆盖写入该文件前调用
+
+        :param filename: str, 文件名
+        """
+        path = os.path.normcase(os.path.abspath(filename))
+        mapped = []
+        for ele in self.files:
+            pulse = ele[self.file_unpack_dict["pulse"]]
+            if isinstance(pulse, Pulses) and pulse.filename is not None \
+                    and os.path.normcase(os.path.abspath(pulse.filename)) == path:
+                mapped.append(ele)
+        if not mapped:
+            return
+
+        # 预览线程按块检查中止请求，等待时间不超过一个数据块
+        for thread in [self.thread_pulse_info_updater] + self.threads_pulse_info_stale:
+            thread.requestInterruption()
+            thread.wait()
+            thread.curve = None
+            thread.pulse_data = None
+        self.static_clear_pulseInfo()
+
+        for ele in mapped:
+            ele[self.file_unpack_dict["pulse"]] = None
+            list_item = ele[self.file_unpack_dict["list_item"]]
+            self.plot_window.removeItem(ele[self.file_unpack_dict["plot"]])
+            self.files.remove(ele)
+            self.listWidget_file.takeItem(self.listWidget_file.row(list_item))
+            self.logger.INFO("[核脉冲模块] 已关闭将被覆盖的文件\"{}\"".format(ele[self.file_unpack_dict["filename"]]))
+        if not len(self.files):
+            self.listWidget_file.clear()
+            self.flag_file_opened = False
+        self.on_file_changed()
 
     def static_update_findPeekInfo(self):
         self.listWidget_findPeek_peeks.clear()
@@ -684,12 +743,15 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         elif algorithm == "导数法":
             level = self.spinBox_findPeek_deri_level.value()
             dots = self.spinBox_findPeek_deri_dots.value()
-            if level == 3 and dots > 7:
-                pop_notice(QMessageBox.Warning, "错误", "三阶导数法仅支持最高7点设置")
-                return
             ranges = [int(ele) for ele in ranges]
             pf = Derivative(curve, ranges, level, dots)
 
+        elif algorithm == "小波变换法":
+            max_width = self.spinBox_findPeek_cwt_width.value()
+            min_snr = self.doubleSpinBox_findPeek_cwt_snr.value()
+            ranges = [int(ele) for ele in ranges]
+            pf = ContinuousWavelet(curve, ranges, widths=np.arange(1, max_width + 1), min_snr=min_snr)
+
         self.peeks = pf  # 将寻到的峰暂存到内存中
         self.static_update_findPeekInfo()  # 更新画面以显示所寻到的峰
 
@@ -813,15 +875,21 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         self.do_display_nucleo()
         self.listWidget_findPeek_peeks.clearSelection()
 
-    def do_draw_pulse(self, data):
-        total_time = data[0][-1]
+    def do_draw_pulse(self, decimator):
+        if self.sender() is not self.thread_pulse_info_updater:
+            return
+        total_time = decimator.x[-1]
 
         self.pulse_plot_window.clear()
+        self.pulse_plot = None
         self.pulse_plot_window.plotItem.getViewBox().setLimits(xMin=-2,
                                                                xMax=total_time + 2,
                                                                yMin=-9, yMax=1024 + 9)
 
-        self.pulse_plot = self.pulse_plot_window.plot(*data,
+        # 按视图宽度做最小/最大值抽稀，缩放时在 on_pulse_view_changed 中重新抽样
+        self.pulse_decimator = decimator
+        x, y = self.pulse_decimator.sample(pixels=self.pulse_plot_window.width())
+        self.pulse_plot = self.pulse_plot_window.plot(x, y,
                                                       pen=None,
                                                       symbol='o',
                                                       symbolSize=1,
@@ -831,17 +899,19 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         self.logger.INFO("[核脉冲模块] 脉冲预览图已绘制")
 
     def do_draw_pulse_time(self, data):
+        if self.sender() is not self.thread_pulse_info_updater:
+            return
         max_time = data[0][-1]
 
         self.pulse_plot_time_window.clear()
         self.pulse_plot_time_window.plotItem.getViewBox().setLimits(xMin=-2,
                                                                     xMax=max_time + 2,
                                                                     yMin=-0.1, yMax=1.1)
-        self.pulse_plot = self.pulse_plot_time_window.plot(*data,
-                                                           pen=pg.mkPen(color=(200, 50, 0),
-                                                                        width=3,
-                                                                        stepMode="left")
-                                                           )
+        self.pulse_time_plot = self.pulse_plot_time_window.plot(*data,
+                                                                pen=pg.mkPen(color=(200, 50, 0),
+                                                                             width=3,
+                                                                             stepMode="left")
+                                                                )
         self.logger.INFO("[核脉冲模块] 脉冲时间间隔概率密度图已绘制")
 
     def do_draw_section(self, section=None):
@@ -894,11 +964,15 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         if self.flag_pulse_generating:
             return
 
+        curve = self.static_get_current_curve()
+        self.static_release_pulse_file(filename)
+
         self.thread_pulse_generator.set_values(filename, csp_rate,
                                                total_time, timed,
                                                open_later,
-                                               self.static_get_current_curve()
+                                               curve
                                                )
+        self.pulse_gen_logged_decile = -1
         self.thread_pulse_generator.start()
 
     def on_action_showNucleo_clicked(self):
@@ -1304,6 +1378,35 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
                         self.section[1] = mouse_point.x()
                         self.do_draw_section()
 
+    def on_pulse_view_changed(self, viewbox, x_range):
+        if self.pulse_plot is None or self.pulse_decimator is None:
+            return
+        x, y = self.pulse_decimator.sample(x_range[0], x_range[1],
+                                           pixels=self.pulse_plot_window.width())
+        self.pulse_plot.setData(x, y)
+
+    def on_pulse_gen_progress(self, done, total, written, eta):
+        msg = "[核脉冲模块] 已生成 {}/{} 个脉冲 ({:.1f}%)，已写入 {:.1f} MB，预计剩余 {:.0f} s".format(
+            done, total, done / total * 100 if total else 100, written / 2 ** 20, eta
+        )
+        # 每个数据块都会回报进度，只在每跨过 10% 时以 INFO 输出，其余记为 DEBUG
+        decile = done * 10 // total if total else 10
+        if decile > self.pulse_gen_logged_decile:
+            self.pulse_gen_logged_decile = decile
+            self.logger.INFO(msg)
+        else:
+            self.logger.DEBUG(msg)
+
+    def closeEvent(self, event):
+        # 退出前中止仍在进行的生成，避免写到一半的文件
+        if self.thread_pulse_generator.isRunning():
+            self.thread_pulse_generator.cancel()
+            self.thread_pulse_generator.wait()
+        for thread in [self.thread_pulse_info_updater] + self.threads_pulse_info_stale:
+            thread.requestInterruption()
+            thread.wait()
+        super(MCA_MainUI, self).closeEvent(event)
+
     def on_open_file(self):
         local_header = "openfile"
         filenames = QFileDialog.getOpenFileNames(caption="打开",
@@ -1314,7 +1417,7 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
                                                  parent=self)[0]
         for ele in filenames:
             try:
-                self.static_add_file(MCA(ele), ele)
+                self.static_add_file(MCA(ele, verify="lazy", on_corrupt=self.file_corrupted.emit), ele)
             except Exception as err:
                 pop_notice(QMessageBox.Warning, "错误", '能谱数据读取失败，请检查文件是否正确。\n\n{}'.format(err))
                 break
@@ -1336,6 +1439,10 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
             self.static_output_tch(filename)
             self.static_add_file(MCA(filename), filename)
 
+    def on_file_corrupted(self, filename):
+        self.logger.ERROR("[文件校验] \"{}\" 校验和不匹配，文件已损坏".format(filename))
+        pop_notice(QMessageBox.Warning, "错误", "文件校验失败，\"{}\" 已损坏，其显示的数据不可信".format(filename))
+
     def on_action_exportLog(self):
         local_header = "export"
         filename = QFileDialog.getSaveFileName(caption="导出",
@@ -1356,7 +1463,10 @@ class MCA_MainUI(QMainWindow, Ui_MainWindow, QApplication):
         if not self.flag_file_opened:
             return
         if self.flag_pulse_generating:
-            pop_notice(QMessageBox.Warning, "提示", "核脉冲生成正在进行，请勿重复点击")
+            ret = QMessageBox.question(self, "提示", "核脉冲生成正在进行，是否中止？",
+                                       QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if ret == QMessageBox.Yes:
+                self.thread_pulse_generator.cancel()
             return
 
         csp_rate = self.doubleSpinBox_pulse_csp_rate.value()
@@ -1400,6 +1510,7 @@ def pop_notice(type, title, msg):
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # 打包后核脉冲并行生成需要
     app = QApplication(sys.argv)
     ui = MCA_MainUI()
     ui.show()
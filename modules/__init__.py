@@ -11,3 +11,4 @@ from .mca import *
 from .threads import *
 from .smooth import *
 from .utils import *
+from .peek_fit import *
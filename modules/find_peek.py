@@ -6,11 +6,224 @@
 # Created on: 2021/11/23
 
 from .mca import MCA, Pulses
+from functools import lru_cache
+from fractions import Fraction
+from math import factorial, gcd
 import numpy as np
 import matplotlib.pyplot as plt
 
 import time
 
+RICKER_CACHE_SIZE = 4  # 每项最大约 (尺度数 * FFT长度 * 8) 字节，只保留最近几种
+
+
+@lru_cache(maxsize=64)
+def derivative_kernel(level, dots):
+    """
+    导数法卷积核，即 dots 点三次（三阶及以上取 level 次）多项式拟合的 level 阶导数。
+    以分数精确求解正规方程，与原系数表一样化为整数权重与公分母，按 (level, dots) 缓存
+
+    :param level: int, 阶数
+    :param dots: int, 点数
+    :return: (np.ndarray(int64) 依次对应偏移 -m..m 的整数权重，只读, int 分母)
+    """
+    m = dots // 2
+    order = max(3, level)
+    if order >= 2 * m + 1:
+        raise ValueError("多项式阶数必须小于点数")
+
+    # 正规方程 G y = e_level，G[j][k] 为 x^(j+k) 在 -m..m 上的和，G 正定，消元无需选主元
+    moments = [sum(x ** k for x in range(-m, m + 1)) for k in range(2 * order + 1)]
+    rows = [[Fraction(moments[j + k]) for k in range(order + 1)] + [Fraction(int(j == level))]
+            for j in range(order + 1)]
+    for j in range(order + 1):
+        for r in range(j + 1, order + 1):
+            ratio = rows[r][j] / rows[j][j]
+            if ratio:
+                rows[r] = [a - ratio * b for a, b in zip(rows[r], rows[j])]
+    y = [Fraction(0)] * (order + 1)
+    for j in range(order, -1, -1):
+        y[j] = (rows[j][-1] - sum(rows[j][k] * y[k] for k in range(j + 1, order + 1))) / rows[j][j]
+
+    coeffs = [factorial(level) * sum(y[j] * x ** j for j in range(order + 1)) for x in range(-m, m + 1)]
+    denominator = 1
+    for ele in coeffs:
+        denominator = denominator * ele.denominator // gcd(denominator, ele.denominator)
+
+    weights = np.array([int(ele * denominator) for ele in coeffs], dtype=np.int64)
+    weights.flags.writeable = False
+    return weights, denominator
+
+
+def zero_crossings(data, falling=True):
+    """
+    向量化查找过零点，即满足 data[a] >= 0 >= data[a+1]（falling）
+    或 data[a] <= 0 <= data[a+1] 的 a，并线性插值出亚道址位置
+
+    :param data: np.ndarray, 导数
+    :param falling: bool, 由正到负或由负到正
+    :return: (np.ndarray(int64) a, np.ndarray(float64) 过零位置)
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if falling:
+        mask = (data[:-1] >= 0) & (data[1:] <= 0)
+    else:
+        mask = (data[:-1] <= 0) & (data[1:] >= 0)
+    index = np.flatnonzero(mask)
+
+    k = data[index + 1] - data[index]
+    location = index + 0.5
+    sloped = k != 0
+    # y = kx + b <=> x = a - y(a) / k
+    location[sloped] = index[sloped] - data[index[sloped]] / k[sloped]
+
+    return index, location
+
+
+def ragged_indices(starts, stops):
+    """
+    把多个区间 [start, stop) 的道址拼接为一个索引数组
+
+    :param starts: np.ndarray(int), 各区间起点
+    :param stops: np.ndarray(int), 各区间终点（不含）
+    :return: (np.ndarray 索引, np.ndarray 各区间在索引数组中的起点, np.ndarray 各区间长度)
+    """
+    lengths = np.maximum(stops - starts, 0)
+    offsets = np.cumsum(lengths) - lengths
+    index = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+    return index, offsets, lengths
+
+
+def segment_reduce(ufunc, values, offsets, lengths, fill):
+    """
+    对 ragged_indices 拼接出的各区间分别做归约，空区间取 fill
+
+    :param ufunc: np.ufunc, 如 np.maximum
+    :param values: np.ndarray, 拼接后的数据
+    :param offsets: np.ndarray, 各区间起点
+    :param lengths: np.ndarray, 各区间长度
+    :param fill: 空区间的值
+    :return: np.ndarray
+    """
+    ret = np.full(len(lengths), fill, dtype=np.result_type(values, fill))
+    nonempty = lengths > 0
+    if nonempty.any():
+        ret[nonempty] = ufunc.reduceat(values, offsets[nonempty])
+    return ret
+
+
+def ricker_bank(channels, widths):
+    """
+    Ricker（墨西哥帽）小波组的频域表示，按 (FFT长度, 尺度) 缓存，道数不同但 FFT 长度相同时共用一项，
+    FFT 长度保证与 channels 道数据的线性卷积不发生回绕
+
+    :param channels: int, 道数
+    :param widths: tuple of float, 小波尺度（道）
+    :return: (int FFT长度, np.ndarray(complex128) (尺度数, FFT长度//2+1))，只读
+    """
+    half = int(np.ceil(5 * max(widths)))
+    nfft = 1 << int(np.ceil(np.log2(channels + half)))
+    return nfft, ricker_spectrum(nfft, widths)
+
+
+@lru_cache(maxsize=RICKER_CACHE_SIZE)
+def ricker_spectrum(nfft, widths):
+    """
+    FFT 长度为 nfft 的 Ricker 小波组频谱
+
+    :param nfft: int, FFT长度
+    :param widths: tuple of float, 小波尺度（道）
+    :return: np.ndarray(complex128) (尺度数, nfft//2+1)，只读
+    """
+    half = int(np.ceil(5 * max(widths)))
+    t = np.arange(-half, half + 1, dtype=np.float64)
+    a = np.array(widths, dtype=np.float64)[:, None]
+    wavelets = 2 / (np.sqrt(3 * a) * np.pi ** 0.25) * (1 - (t / a) ** 2) * np.exp(-t ** 2 / (2 * a ** 2))
+
+    # 小波中心放在第0点，负半轴回绕到末尾，卷积结果无需再平移
+    kernel = np.zeros((len(widths), nfft), dtype=np.float64)
+    kernel[:, t.astype(np.int64) % nfft] = wavelets
+
+    ret = np.fft.rfft(kernel, axis=1)
+    ret.flags.writeable = False
+    return ret
+
+
+def cwt(data, widths):
+    """
+    Ricker 小波连续小波变换，频域相乘实现各尺度卷积
+
+    :param data: np.ndarray, 各道计数
+    :param widths: sequence of float, 小波尺度（道）
+    :return: np.ndarray(float64) (尺度数, 道数)
+    """
+    nfft, bank = ricker_bank(len(data), tuple(float(ele) for ele in widths))
+    ret = np.fft.irfft(np.fft.rfft(np.asarray(data, dtype=np.float64), nfft) * bank, nfft, axis=1)
+    return ret[:, :len(data)]
+
+
+def ridge_lines(coefs, max_distances, gap_thresh=2):
+    """
+    自最大尺度向最小尺度，把各行的局部极大值连接成脊线
+
+    :param coefs: np.ndarray (尺度数, 道数), 小波系数
+    :param max_distances: np.ndarray(int), 每一行上允许脊线平移的最大道数
+    :param gap_thresh: int, 脊线允许连续缺失的行数
+    :return: (np.ndarray 脊线在最小尺度处的道址, np.ndarray 脊线长度,
+              np.ndarray 脊线上的最大系数, np.ndarray 最大系数所在行)
+    """
+    col = np.zeros(0, dtype=np.int64)
+    gap = np.zeros(0, dtype=np.int64)
+    length = np.zeros(0, dtype=np.int64)
+    best = np.zeros(0, dtype=np.float64)
+    best_row = np.zeros(0, dtype=np.int64)
+    finished = []
+
+    for row in range(len(coefs) - 1, -1, -1):
+        line = coefs[row]
+        maxima = np.flatnonzero((line[1:-1] > line[:-2]) & (line[1:-1] >= line[2:]) & (line[1:-1] > 0)) + 1
+
+        target = np.full(len(col), -1, dtype=np.int64)
+        if len(maxima) and len(col):
+            j = np.clip(np.searchsorted(maxima, col), 1, len(maxima) - 1) if len(maxima) > 1 \
+                else np.zeros(len(col), dtype=np.int64)
+            if len(maxima) > 1:
+                j -= (col - maxima[j - 1]) <= (maxima[j] - col)
+            dist = np.abs(maxima[j] - col)
+            near = dist <= max_distances[row]
+
+            # 多条脊线争同一个极大值时，只连接距离最近的一条
+            order = np.lexsort((-best, dist, j))
+            order = order[near[order]]
+            _, first = np.unique(j[order], return_index=True)
+            target[order[first]] = j[order[first]]
+
+        linked = target >= 0
+        col[linked] = maxima[target[linked]]
+        gap[linked] = 0
+        length[linked] += 1
+        value = line[col]
+        better = linked & (value > best)
+        best[better] = value[better]
+        best_row[better] = row
+        gap[~linked] += 1
+
+        ended = gap > gap_thresh
+        finished.append((col[ended], length[ended], best[ended], best_row[ended]))
+        col, gap, length, best, best_row = col[~ended], gap[~ended], length[~ended], best[~ended], best_row[~ended]
+
+        new = np.ones(len(maxima), dtype=bool)
+        new[target[linked]] = False
+        col = np.concatenate((col, maxima[new]))
+        gap = np.concatenate((gap, np.zeros(new.sum(), dtype=np.int64)))
+        length = np.concatenate((length, np.ones(new.sum(), dtype=np.int64)))
+        best = np.concatenate((best, line[maxima[new]]))
+        best_row = np.concatenate((best_row, np.full(new.sum(), row, dtype=np.int64)))
+
+    finished.append((col, length, best, best_row))
+
+    return tuple(np.concatenate(ele) for ele in zip(*finished))
+
 
 class PeekFinder(object):
 
@@ -166,156 +379,114 @@ class Derivative(PeekFinder):
         """
         super(Derivative, self).__init__(mca, scan_range)
 
-        # Kb A0 A1 A2 A3 A4 A5
-        # 注意一阶、三阶导数法参数呈中心对称
-
-        self.__level_table = [[
-            [], [],
-            [12, 0, 8, -1, 0, 0, 0],
-            [252, 0, 58, 67, -22, 0, 0],
-            [1188, 0, 126, 193, 142, -86, 0],
-            [5148, 0, 296, 503, 532, 294, -300]
-        ], [
-            [], [],
-            [7, -2, -1, 2, 0, 0, 0],
-            [42, -4, -3, 0, 5, 0, 0],
-            [462, -20, -17, -8, 7, 28, 0],
-            [429, -10, -9, -6, -1, 6, 15]
-        ], [
-            [], [],
-            [2, 0, -2, 1, 0, 0, 0],
-            [6, 0, -1, -1, 1, 0, 0]
-        ]]
-
+        # 一阶、三阶导数的卷积核呈中心对称，二阶呈轴对称，均由 Savitzky-Golay 拟合生成
         self.m = dots // 2
         self.level = level
 
     def __get_derivatives(self):
         m = self.m
-        level = self.level
         ret = np.zeros(len(self.mca), dtype=np.float64)
-        for i, ele in enumerate(self.mca[m:-m]):
-            ret[m + i] = ele * self.__level_table[level - 1][m][1]
-            for i2 in range(m):
-                ret[m + i] += self.mca[m + i + i2 + 1] * self.__level_table[level - 1][m][i2 + 2]
-                if level % 2:
-                    ret[m + i] += self.mca[m + i - i2 - 1] * self.__level_table[level - 1][m][i2 + 2] * -1
-                else:
-                    ret[m + i] += self.mca[m + i - i2 - 1] * self.__level_table[level - 1][m][i2 + 2]
-            ret[m + i] /= self.__level_table[level - 1][m][0]
+        if len(ret) <= 2 * m:
+            return ret
+
+        weights, denominator = derivative_kernel(self.level, 2 * m + 1)
+        data = np.asarray(self.mca.data)
+        # 整数计数与整数权重在 int64 中乘加没有舍入误差，最后只做一次除法，
+        # 对称位置相消时得到精确的0，过零判断与原系数表一致
+        if float(np.abs(data).max()) * float(np.abs(weights).sum()) < 2 ** 62 and \
+                np.all(data == np.floor(data)):
+            windows = np.lib.stride_tricks.sliding_window_view(data.astype(np.int64), 2 * m + 1)
+            ret[m:len(ret) - m] = windows @ weights
+        else:
+            windows = np.lib.stride_tricks.sliding_window_view(data.astype(np.float64), 2 * m + 1)
+            ret[m:len(ret) - m] = windows @ weights.astype(np.float64)
+        ret /= float(denominator)
 
         return ret
 
-    def __validate(self, peek_location, edges, deri):
-        edges = [int(ele) for ele in edges]
-        deri_range = deri[edges[0]:edges[1]]
-        n = max(deri_range) - min(deri_range)
-        hight_base = self.mca[edges[0]] + self.mca[edges[1]]
-        hight_base /= 2
+    def __validate(self, peeks, left, right, deri):
+        """
+        向量化校验全部候选峰：边界内导数极差不小于 0.8 倍半高宽，且峰位计数不为0
 
-        half_hight = self.mca[int(peek_location)] - hight_base
-        half_hight /= 2
-        half_hight += hight_base
+        :param peeks: np.ndarray(float64), 峰位
+        :param left: np.ndarray(float64), 左边界
+        :param right: np.ndarray(float64), 右边界
+        :param deri: np.ndarray(float64), 导数
+        :return: np.ndarray(bool)
+        """
+        data = self.mca.data
+        top = peeks.astype(np.int64)
+        e0 = np.clip(left.astype(np.int64), 0, len(data) - 1)
+        e1 = np.clip(right.astype(np.int64), 0, len(data) - 1)
+
+        idx, offsets, lengths = ragged_indices(e0, e1)
+        n = segment_reduce(np.maximum, deri[idx], offsets, lengths, 0) - \
+            segment_reduce(np.minimum, deri[idx], offsets, lengths, 0)
+
+        hight_base = (data[e0] + data[e1]) / 2
+        half_hight = (data[top] - hight_base) / 2 + hight_base
+
+        # 峰位向左第一个不高于半高的道
+        idx, offsets, lengths = ragged_indices(e0, top + 1)
+        hit = np.where(data[idx] <= np.repeat(half_hight, lengths), idx, -1)
+        q = segment_reduce(np.maximum, hit, offsets, lengths, -1)
+        left_half = np.where(q >= 0, peeks - (top - q), e0)
+
+        # 峰位向右第一个不高于半高的道
+        idx, offsets, lengths = ragged_indices(top, e1 + 1)
+        hit = np.where(data[idx] <= np.repeat(half_hight, lengths), idx, len(data))
+        q = segment_reduce(np.minimum, hit, offsets, lengths, len(data))
+        right_half = np.where(q < len(data), peeks + (q - top), e1)
 
-        left_half = edges[0]
-        right_half = edges[1]
+        fwhm = right_half - left_half
 
-        for i, ele in enumerate(self.mca[int(peek_location):edges[0] - 1:-1]):
-            if ele <= half_hight:
-                left_half = peek_location - i
-                break
+        return (0.8 * fwhm <= n) & (data[top] != 0)
 
-        for i, ele in enumerate(self.mca[int(peek_location):-edges[1]]):
-            if ele <= half_hight:
-                right_half = peek_location + i
-                break
+    def __find_edges(self, deri, peeks):
+        """
+        向量化求全部候选峰的边界，即峰位左右两侧最近的反向过零点
 
-        fwhm = right_half - left_half
-        ret = 0.8 * fwhm <= n
-        if not self.mca[int(peek_location)]:
-            ret = False
+        :param deri: np.ndarray(float64), 导数
+        :param peeks: np.ndarray(float64), 峰位
+        :return: (np.ndarray(float64) 左边界, np.ndarray(float64) 右边界)
+        """
+        m = self.m
+        top = peeks.astype(np.int64)
+        left = np.full(len(peeks), self.range[0], dtype=np.float64)
+        right = np.full(len(peeks), self.range[1], dtype=np.float64)
 
-        return ret
+        index, location = zero_crossings(deri, falling=self.level != 1)
+        if not len(index):
+            return left, right
 
-    def __find_edges(self, deri, peek_location):
-        left_edge = self.range[0]
-        right_edge = self.range[1]
-        first = True
-        for i, ele in enumerate(deri[int(peek_location):self.m - 1:-1]):
-            if first:
-                first = False
-                continue
-            if self.level == 1 and ele >= 0 and deri[int(peek_location) - i - 1] <= 0:
-                k = ele - deri[int(peek_location) - i - 1]
-                if k:
-                    # y = kx + b <=> b = y - kx <=> x = (y - b) / k
-                    b = ele - k * (peek_location - i)
-                    left_edge = (-b) / k
-                else:
-                    left_edge = peek_location - i - 0.5
-                break
-            elif self.level == 3 and ele <= 0 and deri[int(peek_location) - i - 1] >= 0:
-                k = ele - deri[int(peek_location) - i - 1]
-                if k:
-                    # y = kx + b <=> b = y - kx <=> x = (y - b) / k
-                    b = ele - k * (peek_location - i)
-                    left_edge = (-b) / k
-                else:
-                    left_edge = peek_location - i - 0.5
-                break
-        first = True
-        for i, ele in enumerate(deri[int(peek_location):-(self.m + 1)]):
-            if first:
-                first = False
-                continue
-            if self.level == 1 and ele <= 0 and deri[int(peek_location) + i + 1] >= 0:
-                k = deri[int(peek_location) + i + 1] - ele
-                if k:
-                    # y = kx + b <=> b = y - kx <=> x = (y - b) / k
-                    b = ele - k * (peek_location + i)
-                    right_edge = (-b) / k
-                else:
-                    right_edge = peek_location + i + 0.5
-                break
-            elif self.level == 3 and ele >= 0 and deri[int(peek_location) + i + 1] <= 0:
-                k = deri[int(peek_location) + i + 1] - ele
-                if k:
-                    # y = kx + b <=> b = y - kx <=> x = (y - b) / k
-                    b = ele - k * (peek_location + i)
-                    right_edge = (-b) / k
-                else:
-                    right_edge = peek_location + i + 0.5
-                break
-        return left_edge, right_edge
+        i = np.searchsorted(index, top - 2, side="right") - 1
+        found = i >= 0
+        found[found] = index[i[found]] >= m - 1
+        left[found] = location[i[found]]
+
+        i = np.searchsorted(index, top + 1, side="left")
+        found = i < len(index)
+        found[found] = index[i[found]] <= len(deri) - m - 2
+        right[found] = location[i[found]]
+
+        return left, right
 
     def __find_peeks(self, deri):
-        for i, ele in enumerate(deri[self.range[0]:self.range[1] - 1]):
-            if self.level == 1:
-                if ele >= 0 and deri[self.range[0] + i + 1] <= 0:
-                    k = deri[self.range[0] + i + 1] - ele
-                    if k:
-                        b = ele - k * (self.range[0] + i)
-                        peek = (-b) / k
-                    else:
-                        peek = self.range[0] + i + 0.5
-
-                    edges = self.__find_edges(deri, peek)
-                    peek_object = Peek(peek, edges, self.mca)
-                    if self.__validate(peek, edges, deri):
-                        self.peeks.append(peek_object)
-
-            elif self.level == 3:
-                if ele <= 0 and deri[self.range[0] + i + 1] >= 0:
-                    k = deri[self.range[0] + i + 1] - ele
-                    if k:
-                        b = ele - k * (self.range[0] + i)
-                        peek = (-b) / k
-                    else:
-                        peek = self.range[0] + i + 0.5
-
-                    edges = self.__find_edges(deri, peek)
-                    peek_object = Peek(peek, edges, self.mca)
-                    self.peeks.append(peek_object)
+        if self.level not in (1, 3):
+            return
+
+        index, peeks = zero_crossings(deri, falling=self.level == 1)
+        peeks = peeks[(index >= self.range[0]) & (index < self.range[1] - 1)]
+        if not len(peeks):
+            return
+
+        left, right = self.__find_edges(deri, peeks)
+        if self.level == 1:
+            valid = self.__validate(peeks, left, right, deri)
+            peeks, left, right = peeks[valid], left[valid], right[valid]
+
+        for peek, left_edge, right_edge in zip(peeks.tolist(), left.tolist(), right.tolist()):
+            self.peeks.append(Peek(peek, (left_edge, right_edge), self.mca))
 
     def debug_draw(self):
         plt.plot(self.__get_derivatives())
@@ -347,81 +518,145 @@ class SimpleCompare(PeekFinder):
         self.k = k
         self.m = m
 
-    def __find_peek(self, index, channel_data):
-        peek = None
-        if index >= len(channel_data - self.m):
-            return peek
-
-        for i, cnt in enumerate(channel_data[index + self.m:-self.m]):
-            if not cnt:
-                continue
-            peek_value = cnt - (self.k * cnt ** -0.5)
-
-            # print("[DEBUG] index: {}  peek: {}  peek_value: {}  last: {}  next: {}".format(
-            #     i, cnt, peek_value, channel_data[index + i],
-            #     channel_data[index + i + 2*self.m]))
-            # print("[DEBUG] last_index: {}  current_index: {}  next_index: {}".format(
-            #     index + i, index + i + self.m, index + i + 2*self.m))
-
-            if channel_data[index + i + 2 * self.m] < peek_value and \
-                    peek_value > channel_data[index + i]:
-                peek = index + i + self.m
-                break
-
-        if peek is None:
-            return peek
-
-        maxi = max(channel_data[peek - self.m:peek + self.m])
-        assert isinstance(channel_data, np.ndarray)
-        peek = channel_data.tolist().index(maxi, peek - self.m, peek + self.m)
-
-        return peek
-
-    def __find_left(self, peek_index, channel_data):
-        left_edge = channel_data[0]
-        for i, cnt in enumerate(channel_data[peek_index:self.m - 1:-1]):
-            if not cnt:
-                left_edge = peek_index - i
-                break
-            cnt_v = cnt + (self.k * cnt ** -0.5)
-            # print(cnt, cnt_v, channel_data[peek_index - i - self.m])
-            if cnt_v <= channel_data[peek_index - i - self.m]:
-                left_edge = peek_index - i
-                break
-
-        return left_edge
-
-    def __find_right(self, peek_index, channel_data):
-        right_edge = channel_data[-1]
-        for i, cnt in enumerate(channel_data[peek_index:-self.m]):
-            if not cnt:
-                right_edge = peek_index - i
-                break
-            cnt_v = cnt + (self.k * cnt ** -0.5)
-            if cnt_v <= channel_data[peek_index + i + self.m]:
-                right_edge = peek_index + i
-                break
-
-        return right_edge
+    def __find_peeks(self, channel_data):
+        """
+        向量化简单比较法：cnt - k/sqrt(cnt) 同时大于左右相距 m 的两道时为候选道，
+        候选道取 [c-m, c+m) 内最大值处为峰，下一个峰从峰位 +m 之后的候选道继续找
+
+        :param channel_data: np.ndarray(float64), 扫描范围内的各道计数
+        :return: np.ndarray(int64), 峰位（相对扫描范围起点）
+        """
+        m = self.m
+        n = len(channel_data)
+        if m < 1 or n < 2 * m + 1:
+            return np.zeros(0, dtype=np.int64)
+
+        cnt = channel_data[m:n - m]
+        peek_value = cnt - self.__threshold(cnt)
+        candidates = np.flatnonzero((cnt > 0) &
+                                    (channel_data[2 * m:] < peek_value) &
+                                    (peek_value > channel_data[:n - 2 * m])) + m
+
+        windows = np.lib.stride_tricks.sliding_window_view(channel_data, 2 * m)
+        refined = candidates - m + np.argmax(windows[candidates - m], axis=1)
+
+        ret = []
+        i = 0
+        while i < len(candidates):
+            ret.append(refined[i])
+            # 保证严格前进，最大值落在 c-m 时不会反复命中同一个候选道
+            i = np.searchsorted(candidates, max(refined[i] + m, candidates[i] + 1))
+
+        return np.array(ret, dtype=np.int64)
+
+    def __find_edges(self, peeks, channel_data):
+        """
+        向量化求边界：自峰位向两侧第一个计数为0或 cnt + k/sqrt(cnt) 不大于相距 m 的外侧道的道
+
+        :param peeks: np.ndarray(int64), 峰位（相对扫描范围起点）
+        :param channel_data: np.ndarray(float64), 扫描范围内的各道计数
+        :return: (np.ndarray(int64) 左边界, np.ndarray(int64) 右边界)
+        """
+        m = self.m
+        n = len(channel_data)
+        edge_value = channel_data + self.__threshold(channel_data)
+        stop = (channel_data == 0)
+
+        lefts = np.flatnonzero(stop[m:] | (edge_value[m:] <= channel_data[:n - m])) + m
+        i = np.searchsorted(lefts, peeks, side="right") - 1
+        left = np.where(i >= 0, lefts[np.maximum(i, 0)] if len(lefts) else 0, 0)
+
+        rights = np.flatnonzero(stop[:n - m] | (edge_value[:n - m] <= channel_data[m:]))
+        i = np.searchsorted(rights, peeks, side="left")
+        right = np.where(i < len(rights), rights[np.minimum(i, len(rights) - 1)] if len(rights) else 0, n - 1)
+
+        return left, right
+
+    def __threshold(self, cnt):
+        ret = np.zeros(len(cnt), dtype=np.float64)
+        positive = cnt > 0
+        ret[positive] = self.k / np.sqrt(cnt[positive])
+        return ret
 
     def search(self, scan_range=None):
         super(SimpleCompare, self).search(scan_range)
 
-        index = 0
+        channel_data = np.asarray(self.mca.data[self.range[0]:self.range[1]], dtype=np.float64)
+
+        peeks = self.__find_peeks(channel_data)
+        left, right = self.__find_edges(peeks, channel_data)
 
-        channel_data = self.mca[self.range[0]:self.range[1]]
+        for peek, left_edge, right_edge in zip((peeks + self.range[0]).tolist(),
+                                               (left + self.range[0]).tolist(),
+                                               (right + self.range[0]).tolist()):
+            self.peeks.append(Peek(peek, [left_edge, right_edge], self.mca))
 
-        while index < len(channel_data) - 1:
-            peek = self.__find_peek(index, channel_data)
-            if peek is None:
-                break
-            right_edge = self.__find_right(peek, channel_data) + self.range[0]
-            left_edge = self.__find_left(peek, channel_data) + self.range[0]
-            index = peek
+        self.flag_searched = True
+
+
+class ContinuousWavelet(PeekFinder):
+
+    def __init__(self, mca, scan_range, widths=None, min_snr=5.0, min_length=None, gap_thresh=2):
+        """
+        连续小波变换法，多尺度 Ricker 小波系数的脊线即为峰，对低计数谱无需预先平滑。
+        Ricker 小波为单位能量归一化，泊松噪声下各尺度系数的标准差约为 sqrt(本底计数)
+
+        :param mca: MCA, MCA 谱线对象
+        :param scan_range: (int index_satrt, int index_end)
+        :param widths: sequence of float, 小波尺度（道），应覆盖约 2.2 倍峰标准差，默认 1~16
+        :param min_snr: float, 最小信噪比
+        :param min_length: int, 最短脊线行数，默认为尺度数的1/4
+        :param gap_thresh: int, 脊线允许连续缺失的行数
+        """
+        super(ContinuousWavelet, self).__init__(mca, scan_range)
+        if widths is None:
+            widths = np.arange(1, 17)
+        self.widths = np.sort(np.asarray(widths, dtype=np.float64))
+        self.min_snr = min_snr
+        self.min_length = int(np.ceil(len(self.widths) / 4)) if min_length is None else min_length
+        self.gap_thresh = gap_thresh
+
+    def __noise(self, data, cols):
+        """
+        各脊线处的噪声水平，取附近（前后各 1/40 谱长）计数中位数作为本底的泊松标准差
 
-            edges = [left_edge, right_edge]
+        :param data: np.ndarray, 各道计数
+        :param cols: np.ndarray(int), 道址
+        :return: np.ndarray(float64)
+        """
+        half = max(len(data) // 40, 1)
+        padded = np.pad(np.asarray(data, dtype=np.float64), half, mode="reflect")
+        windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1)[cols]
+        return np.sqrt(np.maximum(np.median(windows, axis=1), 1))
 
-            self.peeks.append(Peek(peek + self.range[0], edges, self.mca))
+    def search(self, scan_range=None):
+        super(ContinuousWavelet, self).search(scan_range)
+
+        data = self.mca.data
+        # 两端按端点值延拓，避免谱的截断处被当作台阶产生假峰
+        pad = int(np.ceil(5 * self.widths[-1]))
+        coefs = cwt(np.pad(np.asarray(data, dtype=np.float64), pad, mode="edge"), self.widths)[:, pad:pad + len(data)]
+        max_distances = np.ceil(self.widths / 4).astype(np.int64)
+        cols, length, best, best_row = ridge_lines(coefs, max_distances, self.gap_thresh)
+
+        keep = (length >= self.min_length) & (cols >= self.range[0]) & (cols < self.range[1])
+        cols, best, best_row = cols[keep], best[keep], best_row[keep]
+        snr = best / self.__noise(data, cols)
+        keep = snr >= self.min_snr
+        cols, snr, best_row = cols[keep], snr[keep], best_row[keep]
+
+        # 多条脊线收敛到同一道时保留信噪比最高的
+        order = np.lexsort((-snr, cols))
+        cols, first = np.unique(cols[order], return_index=True)
+        best_row = best_row[order][first]
+
+        # 高斯峰的系数在尺度约为 2.2 倍标准差处最大，边界取峰位两侧各一个最佳尺度
+        span = np.ceil(self.widths[best_row]).astype(np.int64)
+        left = np.maximum(cols - span, self.range[0])
+        right = np.minimum(cols + span, min(self.range[1], len(data) - 1))
+
+        for peek, left_edge, right_edge in zip(cols.tolist(), left.tolist(), right.tolist()):
+            self.peeks.append(Peek(peek, [left_edge, right_edge], self.mca))
 
         self.flag_searched = True
 
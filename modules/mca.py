@@ -9,6 +9,21 @@ import numpy as np
 import time
 import hashlib
 import struct
+import os
+import json
+import threading
+import tempfile
+import contextlib
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 DICT_DATE = {1: "Jan",
              2: "Feb",
@@ -23,10 +38,468 @@ DICT_DATE = {1: "Jan",
              11: "Nov",
              12: "Dec"}
 
+PULSE_BLOCK_SIZE = 1 << 20  # 流式生成/写入核脉冲时每块的脉冲数
+PULSE_HEAD_SIZE = 54  # .tps/.tch 文件头长度，脉冲/能谱数据紧随其后
+HASH_CHUNK_SIZE = 1 << 24  # 分块计算文件校验和时每块的字节数
+# ORTEC CHN 文件头（32B）与能量刻度尾（16B）
+CHN_HEAD_DTYPE = np.dtype([("version", "<i2"),
+                           ("mca_detector_id", "<i2"),
+                           ("segment_number", "<i2"),
+                           ("start_time_ss", "S2"),
+                           ("real_time", "<u4"),
+                           ("live_time", "<u4"),
+                           ("start_date", "S8"),
+                           ("start_time_hhmm", "S4"),
+                           ("ch_offset", "<i2"),
+                           ("channels", "<i2")])
+CHN_TAIL_DTYPE = np.dtype([("flag", "<i2"),  # 固定为-102
+                           ("reserved", "<i2"),
+                           ("energyX_b", "<f4"),
+                           ("energyX_a", "<f4"),
+                           ("energyX_c", "<f4")])
+VERIFY_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".pucleus", "verified.json")
+VERIFY_CACHE_LIMIT = 4096  # 校验缓存最多保留的记录数，超出时丢弃最早的记录
+
+
+def file_sha256(filename):
+    """
+    分块计算 .tps/.tch 文件除校验和字段(22:54)以外全部内容的sha256
+
+    :param filename: str, 文件名
+    :return: bytes, sha256摘要
+    """
+    hasher = hashlib.sha256()
+    with open(filename, "rb") as f:
+        hasher.update(f.read(22))
+        f.seek(PULSE_HEAD_SIZE)
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+        f.close()
+    return hasher.digest()
+
+
+def histogram_pulses(pulses, channels, block_size=PULSE_BLOCK_SIZE):
+    """
+    分块 bincount 统计各道脉冲数，可直接作用于内存映射的脉冲数据
+
+    :param pulses: np.ndarray, 1维道址或 N×2 [道址, 时间间隔]
+    :param channels: int, 道数
+    :param block_size: int, 每块脉冲数
+    :return: (np.ndarray(int64) 各道计数, int 超出道址范围而被丢弃的脉冲数)
+    """
+    if pulses.ndim == 2:
+        pulses = pulses[:, 0]
+
+    res = np.zeros(channels, dtype=np.int64)
+    out_of_range = 0
+    for i in range(0, len(pulses), block_size):
+        block = np.asarray(pulses[i:i + block_size])
+        valid = (block >= 0) & (block < channels)
+        if not valid.all():
+            out_of_range += len(block) - int(valid.sum())
+            block = block[valid]
+        res += np.bincount(block, minlength=channels)
+
+    return res, out_of_range
+
+
+def histogram_time_windows(pulses, channels, edges, block_size=PULSE_BLOCK_SIZE):
+    """
+    一次遍历带时间间隔的脉冲，按各脉冲的绝对时间统计多个时间窗口内的能谱。
+    绝对时间为该脉冲之前所有时间间隔之和，逐块累加，不需要完整的时间索引
+
+    :param pulses: np.ndarray, N×2 [道址, 时间间隔(us)]
+    :param channels: int, 道数
+    :param edges: list, 单调递增的窗口边界(s)，第i个窗口为 [edges[i], edges[i+1])
+    :param block_size: int, 每块脉冲数
+    :return: (np.ndarray(int64) 形状为 (窗口数, 道数), np.ndarray(int64) 各窗口内超出道址范围而被丢弃的脉冲数)
+    """
+    edges_us = np.round(np.asarray(edges, dtype=np.float64) * 10 ** 6).astype(np.int64)
+    windows = len(edges_us) - 1
+
+    res = np.zeros(windows * channels, dtype=np.int64)
+    out_of_range = np.zeros(windows, dtype=np.int64)
+    time_i = 0
+    for i in range(0, len(pulses), block_size):
+        block = np.asarray(pulses[i:i + block_size])
+        intervals = block[:, 1].astype(np.int64)
+        time_abs = np.cumsum(intervals)
+        time_abs += time_i - intervals
+        time_i = int(time_abs[-1] + intervals[-1])
+
+        index = np.searchsorted(edges_us, time_abs, side="right") - 1
+        ch = block[:, 0].astype(np.int64)
+        in_window = (index >= 0) & (index < windows)
+        valid = in_window & (ch >= 0) & (ch < channels)
+        res += np.bincount(index[valid] * channels + ch[valid], minlength=windows * channels)
+        out_of_range += np.bincount(index[in_window & ~valid], minlength=windows)
+
+    return res.reshape(windows, channels), out_of_range
+
+
+def lock_file(f):
+    """
+    对已打开的文件加跨进程排他锁，阻塞直到获得锁
+
+    :param f: file, 以二进制方式打开的文件
+    """
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class VerifyCache(object):
+
+    def __init__(self, filename=VERIFY_CACHE_FILE, autosave=True, limit=VERIFY_CACHE_LIMIT):
+        """
+        本地校验缓存，记录已通过校验的文件（按路径、大小、修改时间、校验和），
+        文件未被改动时可直接信任而不必重新计算sha256。
+        多个进程共用同一缓存文件，保存时在文件锁内重新读取并合并，再以临时文件整体替换，
+        同时清除文件已不存在或已被改动的记录，并最多保留 limit 条
+
+        :param filename: str, 缓存文件路径
+        :param autosave: bool, 每次 add 后立即保存，为False时需手动 save
+        :param limit: int, 最多保留的记录数
+        """
+        self.filename = filename
+        self.autosave = autosave
+        self.limit = limit
+        self.lock = threading.RLock()
+        self.__records = None
+        self.__signature = None
+        self.__pending = {}
+        self.__hold = 0
+
+    def __read(self):
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                ret = json.load(f)
+                f.close()
+        except (OSError, ValueError):
+            ret = {}
+        return ret if isinstance(ret, dict) else {}
+
+    def __locked(self, func):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(self.filename + ".lock", "ab") as f:
+            lock_file(f)
+            try:
+                return func()
+            finally:
+                unlock_file(f)
+                f.close()
+
+    def __stat(self):
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        # 每次保存都以新文件替换，inode 随之变化
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def __load(self):
+        """
+        首次使用时读取缓存文件，之后仅在文件大小或修改时间变化（被其他进程改写）时重新读取
+        """
+        signature = self.__stat()
+        if self.__records is not None and signature == self.__signature:
+            return
+        try:
+            records = self.__locked(self.__read)
+        except OSError:
+            records = {}
+        records.update(self.__pending)
+        self.__records = records
+        self.__signature = signature
+
+    def __record(self, filename, sha):
+        stat = os.stat(filename)
+        return [stat.st_size, stat.st_mtime_ns, sha.hex()]
+
+    def is_verified(self, filename, sha):
+        with self.lock:
+            try:
+                record = self.__record(filename, sha)
+            except OSError:
+                return False
+            # 缓存文件被其他进程改写时才会重新读取
+            self.__load()
+            return self.__records.get(os.path.abspath(filename)) == record
+
+    def add(self, filename, sha):
+        try:
+            record = self.__record(filename, sha)
+        except OSError:
+            return
+        self.merge({os.path.abspath(filename): record})
+
+    def merge(self, records):
+        """
+        合并其他进程交来的校验记录
+
+        :param records: dict, 由 pop_pending 得到的记录
+        """
+        with self.lock:
+            self.__load()
+            self.__pending.update(records)
+            self.__records.update(records)
+            if self.autosave and not self.__hold:
+                self.save()
+
+    def pop_pending(self):
+        """
+        取出尚未保存的记录，用于交给父进程统一保存
+
+        :return: dict
+        """
+        with self.lock:
+            ret = self.__pending
+            self.__pending = {}
+            return ret
+
+    @contextlib.contextmanager
+    def hold(self):
+        """
+        批量记录，期间的 add/merge 只在退出时保存一次
+        """
+        with self.lock:
+            self.__hold += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.__hold -= 1
+                if self.autosave and not self.__hold:
+                    self.save()
+
+    def save(self):
+        with self.lock:
+            if not self.__pending:
+                return
+            pending = self.__pending
+
+            def write():
+                records = self.__read()
+                for key in pending:
+                    records.pop(key, None)
+                records.update(pending)
+                records = self.__prune(records)
+                fd, temp = tempfile.mkstemp(dir=os.path.dirname(self.filename), suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        json.dump(records, f)
+                        f.close()
+                    os.replace(temp, self.filename)
+                except OSError:
+                    os.remove(temp)
+                    raise
+                return records
+
+            try:
+                self.__records = self.__locked(write)
+                self.__signature = self.__stat()
+                self.__pending = {}
+            except OSError:
+                pass
+
+    def __prune(self, records):
+        """
+        清除文件已不存在或大小、修改时间已变化的记录，并只保留最近的 limit 条
+
+        :param records: dict, 按写入先后排列的记录
+        :return: dict
+        """
+        ret = {}
+        for key, record in list(records.items())[-self.limit:]:
+            try:
+                stat = os.stat(key)
+            except OSError:
+                continue
+            if [stat.st_size, stat.st_mtime_ns] == record[:2]:
+                ret[key] = record
+        return ret
+
+
+VERIFY_CACHE = VerifyCache()
+
+
+class ChecksumVerifier(threading.Thread):
+
+    def __init__(self, filename, sha, on_corrupt=None):
+        """
+        后台校验线程，校验失败时调用 on_corrupt(filename)
+
+        :param filename: str, 文件名
+        :param sha: bytes, 文件头中记录的sha256校验和
+        :param on_corrupt: callable, 校验失败回调
+        """
+        super(ChecksumVerifier, self).__init__(daemon=True)
+        self.filename = filename
+        self.sha = sha
+        self.on_corrupt = on_corrupt
+        self.result = None  # None: 校验中  True: 通过  False: 文件损坏
+
+    def run(self):
+        self.result = file_sha256(self.filename) == self.sha
+        if self.result:
+            VERIFY_CACHE.add(self.filename, self.sha)
+        elif self.on_corrupt is not None:
+            self.on_corrupt(self.filename)
+
+
+def verify_file(filename, sha, data=None, verify="sync", on_corrupt=None):
+    """
+    校验 .tps/.tch 文件
+
+    :param filename: str, 文件名
+    :param sha: bytes, 文件头中记录的sha256校验和
+    :param data: bytes, 已读入内存的完整文件内容，为None时分块读取文件计算
+    :param verify: str, 校验方式
+                   "sync": 立即校验，失败抛出异常
+                   "lazy": 在后台线程中校验，失败时调用 on_corrupt
+                   "trust": 校验缓存中已记录且文件未改动时跳过，否则同 "sync"
+                   "none": 不校验
+    :param on_corrupt: callable, "lazy" 模式下校验失败的回调 on_corrupt(filename)
+    :return: ChecksumVerifier, "lazy" 模式下启动的校验线程，其余情况为None
+    """
+    if verify == "none":
+        return None
+    if verify in ("lazy", "trust") and VERIFY_CACHE.is_verified(filename, sha):
+        return None
+    if verify == "lazy":
+        verifier = ChecksumVerifier(filename, sha, on_corrupt)
+        verifier.start()
+        return verifier
+
+    if data is None:
+        digest = file_sha256(filename)
+    else:
+        hasher = hashlib.sha256()
+        hasher.update(data[:22])
+        hasher.update(data[PULSE_HEAD_SIZE:])
+        digest = hasher.digest()
+    if sha != digest:
+        raise Exception("文件损坏")
+    VERIFY_CACHE.add(filename, sha)
+
+    return None
+
+
+def sample_channels(accu, size, rng=None):
+    """
+    逆累积分布抽样，一次 searchsorted 得到全部脉冲的道址
+
+    :param accu: np.ndarray, 能谱累积计数（单调不减）
+    :param size: int, 抽样脉冲数
+    :param rng: np.random.Generator, 随机数生成器，默认新建
+    :return: np.ndarray(int32), 道址
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    rand = rng.integers(0, int(accu[-1]), size=size)
+    # 道址等于累积计数中不大于随机数的元素个数
+    res = np.searchsorted(accu, rand, side="right").astype(np.int32)
+    return res
+
+
+def sample_intervals(csp_rate, size, rng=None):
+    """
+    按指数分布直接抽样脉冲时间间隔，向下取整到微秒
+
+    :param csp_rate: float, 计数率(cps)
+    :param size: int, 抽样脉冲数
+    :param rng: np.random.Generator, 随机数生成器，默认新建
+    :return: np.ndarray(uint32), 时间间隔(us)
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    time_res = rng.exponential(10 ** 6 / csp_rate, size=size)
+    time_res = np.minimum(time_res, np.iinfo(np.uint32).max)
+    return time_res.astype(np.uint32)
+
+
+def gen_pulse_block(accu, size, seed_seq, csp_rate=None):
+    """
+    用独立的随机数生成器生成一块核脉冲，可在子进程中执行
+
+    :param accu: np.ndarray, 能谱累积计数
+    :param size: int, 本块脉冲数
+    :param seed_seq: np.random.SeedSequence, 本块的种子序列
+    :param csp_rate: float, 计数率(cps)，为None时不生成时间间隔
+    :return: np.ndarray, 1维道址(int32)或 N×2 [道址, 时间间隔(us)](uint32)
+    """
+    rng = np.random.default_rng(seed_seq)
+    res = sample_channels(accu, size, rng)
+    if csp_rate is not None:
+        time_res = sample_intervals(csp_rate, size, rng)
+        res = np.column_stack((res, time_res)).astype(np.uint32)
+    return res
+
+
+def iter_pulse_blocks(accu, total_pulses, csp_rate=None, block_size=PULSE_BLOCK_SIZE,
+                      seed=None, workers=1):
+    """
+    按块顺序产出核脉冲。第i块的种子固定为 SeedSequence(seed).spawn() 的第i个子序列，
+    因此同一seed在任意进程数下生成完全相同的脉冲序列
+
+    :param accu: np.ndarray, 能谱累积计数
+    :param total_pulses: int, 脉冲总数
+    :param csp_rate: float, 计数率(cps)，为None时不生成时间间隔
+    :param block_size: int, 每块脉冲数
+    :param seed: int / list of int, 随机种子（SeedSequence 的熵），为None时随机
+    :param workers: int, 进程数，为None时使用全部CPU核心
+    :return: generator of np.ndarray
+    """
+    total_pulses = int(total_pulses)
+    sizes = [block_size] * (total_pulses // block_size)
+    if total_pulses % block_size:
+        sizes.append(total_pulses % block_size)
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1 or len(sizes) <= 1:
+        for size, seed_seq in zip(sizes, seed_seqs):
+            yield gen_pulse_block(accu, size, seed_seq, csp_rate)
+        return
+
+    # 最多同时挂起 2*workers 块，保证内存占用有界且按序输出；
+    # 以 spawn 启动子进程，从带 Qt 线程的进程中 fork 可能继承被占用的锁而死锁
+    tasks = zip(sizes, seed_seqs)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = deque(executor.submit(gen_pulse_block, accu, size, seed_seq, csp_rate)
+                        for size, seed_seq in islice(tasks, 2 * workers))
+        while pending:
+            res = pending.popleft().result()
+            for size, seed_seq in islice(tasks, 1):
+                pending.append(executor.submit(gen_pulse_block, accu, size, seed_seq, csp_rate))
+            yield res
+
 
 class MCA(object):
 
-    def __init__(self, data=None):
+    def __init__(self, data=None, verify="sync", on_corrupt=None):
+        """
+        能谱对象
+
+        :param data: str 文件名 / list, tuple, np.ndarray 各道计数 / MCA
+        :param verify: str, 打开 .tch/.tps 文件时的校验方式，见 verify_file
+        :param on_corrupt: callable, 后台校验失败回调 on_corrupt(filename)
+        """
 
         # chn args
         self.version = -1
@@ -52,9 +525,12 @@ class MCA(object):
         self.energyX_c = 0
         self.timestamp = 0
 
+        self.checksum_verifier = None
+        self.out_of_range = 0  # 由脉冲生成能谱时超出道址范围而被丢弃的脉冲数
+
         if isinstance(data, str):
 
-            self.from_file(data)
+            self.from_file(data, verify, on_corrupt)
 
         elif isinstance(data, list) or isinstance(data, np.ndarray) or isinstance(data, tuple):
             data_t = data
@@ -214,93 +690,88 @@ class MCA(object):
     def std(self):
         return np.std(self.data)
 
-    def from_file(self, filename):
-        if filename[-3:] in ("mca", "txt"):
-            f = open(filename, 'r', encoding="utf-8")
-            data_raw = []
-            data = f.readlines()
-
-            for i, ele in enumerate(data):
-                while len(ele) > 1 and ele[-1] in ("\r", "\n"):
-                    ele = ele[:-1]
-                if ele:
-                    if ele[0] == "#":
-                        if ":" not in ele:
-                            continue
-                        t = ele.replace(" ", "").split(":")
-                        if "version" in ele.lower():
-                            self.version = int(t[-1])
-                        elif "mca detector id" in ele.lower():
-                            self.mca_detector_id = int(t[-1])
-                        elif "start time" in ele.lower():
-                            self.start_time_hhmm = t[-3] + t[-2]
-                            self.start_time_ss = t[-1]
-                            self.start_time_hhmm.encode()
-                            self.start_time_ss.encode()
-                        elif "start date" in ele.lower():
-                            self.start_date = t[-1].encode()
-                        elif "no channels" in ele.lower():
-                            self.channels = int(t[-1])
-                        elif "live time" in ele.lower():
-                            self.live_time = int(t[-1])
-                            self.total_time = self.live_time / 50
-                        elif "real time" in ele.lower():
-                            self.real_time = int(t[-1])
-                        elif "#a:" in ele.lower().replace(" ", ""):
-                            self.energyX_b = float(t[-1])
-                        elif "#b:" in ele.lower().replace(" ", ""):
-                            self.energyX_a = float(t[-1])
-                        elif "#c:" in ele.lower().replace(" ", ""):
-                            self.energyX_c = float(t[-1])
-                    else:
-                        data_raw.append(int(ele))
-
-            tail = True
-            while len(data_raw) > self.channels:
-                if tail:
-                    data_raw = data_raw[:-1]
-                    tail = False
-                    for i in range(6):
-                        data_raw[i] = 0
-                else:
-                    data_raw = data_raw[1:]
+    def from_file(self, filename, verify="sync", on_corrupt=None):
+        ext = os.path.splitext(filename)[1][1:].lower()
+        if ext in ("mca", "txt"):
+            with open(filename, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+                f.close()
+
+            for ele in [ele for ele in lines if ele.startswith("#")]:
+                if ":" not in ele:
+                    continue
+                t = ele.replace(" ", "").split(":")
+                lower = ele.lower()
+                if "version" in lower:
+                    self.version = int(t[-1])
+                elif "mca detector id" in lower:
+                    self.mca_detector_id = int(t[-1])
+                elif "start time" in lower:
+                    self.start_time_hhmm = (t[-3] + t[-2]).encode()
+                    self.start_time_ss = t[-1].encode()
+                elif "start date" in lower:
+                    self.start_date = t[-1].encode()
+                elif "no channels" in lower:
+                    self.channels = int(t[-1])
+                elif "live time" in lower:
+                    self.live_time = int(t[-1])
+                    self.total_time = self.live_time / 50
+                elif "real time" in lower:
+                    self.real_time = int(t[-1])
+                elif "#a:" in lower.replace(" ", ""):
+                    self.energyX_b = float(t[-1])
+                elif "#b:" in lower.replace(" ", ""):
+                    self.energyX_a = float(t[-1])
+                elif "#c:" in lower.replace(" ", ""):
+                    self.energyX_c = float(t[-1])
+
+            # 数据行整体交给 loadtxt 解析，注释行与空行自动跳过
+            if any(ele and not ele.startswith("#") for ele in lines):
+                data_raw = np.loadtxt(lines, dtype=np.int64, comments="#", ndmin=1)
+            else:
+                data_raw = np.zeros(0, dtype=np.int64)
+
+            # 数据多于道数时：去掉最后一道并清零前6道，再从头部截去多余的道
+            if len(data_raw) > self.channels:
+                data_raw = data_raw[:-1]
+                data_raw[:6] = 0
+                data_raw = data_raw[len(data_raw) - self.channels:]
 
             self.data = np.array(data_raw, dtype=np.float64)
             self.channels = len(self.data)
 
-        elif filename[-3:] == "chn":
-            f = open(filename, 'rb')
-            self.version = struct.unpack('h', f.read(2))[0]
-            self.mca_detector_id = struct.unpack('h', f.read(2))[0]
-            self.segment_number = struct.unpack('h', f.read(2))[0]
-            self.start_time_ss = f.read(2)
-            self.real_time = struct.unpack('I', f.read(4))[0]
-            self.live_time = struct.unpack('I', f.read(4))[0]
-            self.start_date = f.read(8)  # Ascii type date in
-            # DDMMMYY* where * == 1 means 21th century
-            self.start_time_hhmm = f.read(4)
-            self.ch_offset = struct.unpack('h', f.read(2))[0]
-            self.channels = struct.unpack('h', f.read(2))[0]
-            self.data = np.zeros(self.channels, dtype=np.float64)
-            self.total_time = self.live_time / 50
-            for i in range(self.channels):
-                self.data[i] = struct.unpack('I', f.read(4))[0]
-            f_next = f.read(2)
-            if not f_next:
+        elif ext == "chn":
+            with open(filename, "rb") as f:
+                head = np.fromfile(f, dtype=CHN_HEAD_DTYPE, count=1)[0]
+                self.version = int(head["version"])
+                self.mca_detector_id = int(head["mca_detector_id"])
+                self.segment_number = int(head["segment_number"])
+                self.start_time_ss = bytes(head["start_time_ss"])
+                self.real_time = int(head["real_time"])
+                self.live_time = int(head["live_time"])
+                self.start_date = bytes(head["start_date"])  # Ascii type date in
+                # DDMMMYY* where * == 1 means 21th century
+                self.start_time_hhmm = bytes(head["start_time_hhmm"])
+                self.ch_offset = int(head["ch_offset"])
+                self.channels = int(head["channels"])
+                self.total_time = self.live_time / 50
+                self.data = np.fromfile(f, dtype="<u4", count=self.channels).astype(np.float64)
+                tail = f.read(CHN_TAIL_DTYPE.itemsize)
+                f.close()
+            if not tail:
                 return
-            assert struct.unpack('h', f_next)[0] == -102
-            f.read(2)
-            self.energyX_b = struct.unpack('f', f.read(4))[0]
-            self.energyX_a = struct.unpack('f', f.read(4))[0]
-            self.energyX_c = struct.unpack('f', f.read(4))[0]
-
-            f.close()
-
-        elif filename[-3:] == "tps":
-            pulse = Pulses(filename)
+            tail = np.frombuffer(tail, dtype=CHN_TAIL_DTYPE, count=1)[0]
+            assert tail["flag"] == -102
+            self.energyX_b = float(tail["energyX_b"])
+            self.energyX_a = float(tail["energyX_a"])
+            self.energyX_c = float(tail["energyX_c"])
+
+        elif ext == "tps":
+            pulse = Pulses(filename, mmap=True, verify=verify, on_corrupt=on_corrupt)
             self.from_pulses(pulse)
+            self.checksum_verifier = pulse.checksum_verifier
 
-        elif filename[-3:] == "tch":
+        elif ext == "tch":
             with open(filename, "rb") as f:
                 data = f.read()
                 f.close()
@@ -326,11 +797,7 @@ class MCA(object):
             self.energyX_b = struct.unpack("f", enX_b)[0]
 
             sha = data[22:54]  # 32B 全文除此字段的sha256校验和
-            hasher = hashlib.sha256()
-            hasher.update(data[:22])
-            hasher.update(data[54:])
-            if sha != hasher.digest():
-                raise Exception("文件损坏")
+            self.checksum_verifier = verify_file(filename, sha, data, verify, on_corrupt)
 
             self.start_time_hhmm = time.strftime("%H%M", time.localtime(self.timestamp / 1000)).encode()
             self.start_time_ss = time.strftime("%S", time.localtime(self.timestamp / 1000)).encode()
@@ -341,13 +808,11 @@ class MCA(object):
             data = data[54:]  # 4N*B 脉冲数据
             self.data = np.frombuffer(data, dtype=np.uint32)
 
+        else:
+            raise TypeError("错误的文件类型")
+
     def to_accumulation(self):
-        sum = []
-        sum_raw = 0
-        for i in self.data:
-            sum_raw += i
-            sum.append(sum_raw)
-        ret = np.array(sum, dtype=np.float64)
+        ret = np.cumsum(self.data, dtype=np.float64)
         return MCA(ret)
 
     def to_probDensity(self):
@@ -364,7 +829,7 @@ class MCA(object):
 
         data = b""
 
-        file_end = filename.split(".")[-1]
+        file_end = filename.split(".")[-1].lower()
 
         if file_end == "tch":  # 自定义TCH能谱文件格式
             head = "CHN"
@@ -413,29 +878,31 @@ class MCA(object):
                 data += "# A : {}\r\n".format(self.energyX_b).encode()
                 data += "# B : {}\r\n".format(self.energyX_a).encode()
                 data += "# C : {}\r\n".format(self.energyX_c).encode()
-            for i in self.data:
-                data += str(int(i)).encode()
+            if len(self.data):
+                data += "\r\n".join(map(str, self.data.astype(np.int64).tolist())).encode()
                 data += b"\r\n"
 
         elif file_end == "chn":
-            data += self.version.to_bytes(2, "little", signed=True)
-            data += self.mca_detector_id.to_bytes(2, "little", signed=True)
-            data += self.segment_number.to_bytes(2, "little", signed=True)
-            data += self.start_time_ss
-            data += self.real_time.to_bytes(4, "little", signed=False)
-            data += self.live_time.to_bytes(4, "little", signed=False)
-            data += self.start_date
-            data += self.start_time_hhmm
-            data += self.ch_offset.to_bytes(2, "little", signed=True)
-            data += self.channels.to_bytes(2, "little", signed=True)
-            for e in self.data:
-                data += int(e).to_bytes(4, "little", signed=False)
+            head = np.zeros(1, dtype=CHN_HEAD_DTYPE)
+            head["version"] = self.version
+            head["mca_detector_id"] = self.mca_detector_id
+            head["segment_number"] = self.segment_number
+            head["start_time_ss"] = self.start_time_ss
+            head["real_time"] = self.real_time
+            head["live_time"] = self.live_time
+            head["start_date"] = self.start_date
+            head["start_time_hhmm"] = self.start_time_hhmm
+            head["ch_offset"] = self.ch_offset
+            head["channels"] = self.channels
+            data += head.tobytes()
+            data += self.data.astype("<u4").tobytes()
             if self.energyX_a:
-                data += int(-102).to_bytes(2, "little", signed=True)
-                data += b"\x00\x00"
-                data += struct.pack("f", self.energyX_b)
-                data += struct.pack("f", self.energyX_a)
-                data += struct.pack("f", self.energyX_c)
+                tail = np.zeros(1, dtype=CHN_TAIL_DTYPE)
+                tail["flag"] = -102
+                tail["energyX_b"] = self.energyX_b
+                tail["energyX_a"] = self.energyX_a
+                tail["energyX_c"] = self.energyX_c
+                data += tail.tobytes()
 
         with open(filename, "wb") as f:
             ret = f.write(data)
@@ -443,17 +910,48 @@ class MCA(object):
 
         return ret
 
-    def to_pulses(self, total_pulses=None):
+    def iter_pulses(self, total_pulses=None, block_size=PULSE_BLOCK_SIZE, seed=None, workers=1):
+        """
+        分块生成核脉冲道址，每块不超过 block_size 个脉冲
+
+        :param total_pulses: int, 脉冲总数，默认为能谱总计数
+        :param block_size: int, 每块脉冲数
+        :param seed: int, 随机种子，相同种子生成相同的脉冲
+        :param workers: int, 并行生成的进程数，为None时使用全部CPU核心
+        :return: generator of np.ndarray(int32)
+        """
         if total_pulses is None:
             total_pulses = int(self.sum())
-        total_pulses = int(total_pulses)
-        np.random.seed(int(time.time()))
-        accu = self.to_accumulation()
-        rand = np.random.randint(0, accu.max(), size=(total_pulses,))
-        res = np.zeros(total_pulses, dtype=np.int32)
-        for ele in accu:
-            t = rand >= ele
-            res += t
+        accu = self.to_accumulation().as_numpy()
+
+        return iter_pulse_blocks(accu, total_pulses, None, block_size, seed, workers)
+
+    def iter_timed_pulses(self, csp_rate=2000, total_time=200, block_size=PULSE_BLOCK_SIZE,
+                          seed=None, workers=1, total_pulses=None):
+        """
+        分块生成带时间间隔的核脉冲，每块为 N×2 的 [道址, 时间间隔(us)]
+
+        :param csp_rate: float, 计数率(cps)
+        :param total_time: float, 测量时间(s)
+        :param block_size: int, 每块脉冲数
+        :param seed: int, 随机种子，相同种子生成相同的脉冲
+        :param workers: int, 并行生成的进程数，为None时使用全部CPU核心
+        :param total_pulses: int, 脉冲总数，默认为 int(csp_rate * total_time)
+        :return: generator of np.ndarray(uint32)
+        """
+        if total_pulses is None:
+            total_pulses = int(csp_rate * total_time)
+        accu = self.to_accumulation().as_numpy()
+
+        return iter_pulse_blocks(accu, total_pulses, csp_rate,
+                                 block_size, seed, workers)
+
+    def to_pulses(self, total_pulses=None, seed=None, workers=1):
+        blocks = list(self.iter_pulses(total_pulses, seed=seed, workers=workers))
+        if blocks:
+            res = np.concatenate(blocks)
+        else:
+            res = np.zeros(0, dtype=np.int32)
 
         res = Pulses(res)
         res.total_time = self.total_time
@@ -464,39 +962,13 @@ class MCA(object):
 
         return res
 
-    def to_timed_pulses(self, csp_rate=2000, total_time=200):
-        pulses = self.to_pulses(int(csp_rate * total_time))
-        pulses = pulses.data
-
-        time_x = np.linspace(0, -np.log(10 ** -9) / csp_rate, 8193, dtype=np.float64)
-        time_x0 = time_x[0: 8192].copy()
-        time_x1 = time_x[1: 8193].copy()
-
-        time_p = np.exp(-csp_rate * time_x0) - np.exp(-csp_rate * time_x1)
-
-        time_p_sum = np.zeros(len(time_p), dtype=np.float64)
-
-        inter = 0
-        for i, ele in enumerate(time_p):
-            inter += ele
-            time_p_sum[i] = inter
-
-        rand = np.random.random(len(pulses))
-
-        time_res_index = np.zeros(len(pulses), dtype=np.uint32)
-
-        for i in time_p_sum:
-            t = rand >= i
-            time_res_index += t
-
-        # print(len(time_p), len(time_p_sum), np.max(time_res_index), np.min(time_res_index))
-        time_x0 *= 10 ** 6
-
-        time_res = [int(time_x0[ele]) for ele in time_res_index]
+    def to_timed_pulses(self, csp_rate=2000, total_time=200, seed=None, workers=1):
+        blocks = list(self.iter_timed_pulses(csp_rate, total_time, seed=seed, workers=workers))
+        if blocks:
+            res = np.concatenate(blocks)
+        else:
+            res = np.zeros((0, 2), dtype=np.uint32)
 
-        # print(pulses.ndim, pulses.ndim)
-        res = np.dstack((pulses, time_res)).astype(np.uint32)
-        res = np.squeeze(res)
         ret = Pulses(res)
         ret.total_time = total_time
         ret.energyX_a = self.energyX_a
@@ -506,42 +978,117 @@ class MCA(object):
 
         return ret
 
-    def from_pulses(self, pulses, max_channel=1024):
-        if isinstance(pulses, list) or isinstance(pulses, tuple) or isinstance(pulses, np.ndarray):
-            res = np.zeros(max_channel, dtype=np.int32)
-            for ele in pulses:
-                res[ele] += 1
+    def to_pulse_file(self, filename, csp_rate=2000, total_time=200, timed=False,
+                      block_size=PULSE_BLOCK_SIZE, seed=None, workers=1, timestamp=None,
+                      callback=None, total_pulses=None):
+        """
+        流式生成核脉冲并逐块写入 .tps 文件，内存占用与脉冲总数无关
+
+        :param filename: str, 目标文件名
+        :param csp_rate: float, 计数率(cps)
+        :param total_time: float, 测量时间(s)
+        :param timed: bool, 是否附带时间间隔
+        :param block_size: int, 每块脉冲数
+        :param seed: int / list of int, 随机种子，相同种子生成相同的文件内容
+        :param workers: int, 并行生成的进程数，为None时使用全部CPU核心
+        :param timestamp: int, 文件头时间戳(ms)，默认为当前时间
+        :param callback: callable, 每写入一块后调用 callback(已生成脉冲数, 脉冲总数, 已写入字节数)，
+                         返回False时中止生成并删除未完成的文件
+        :param total_pulses: int, 脉冲总数，默认为 int(csp_rate * total_time)
+        :return: int, 写入的字节数，中止时为None
+        """
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        if total_pulses is None:
+            total_pulses = int(csp_rate * total_time)
 
-            self.data = res.astype(np.float64)
+        if timed:
+            blocks = self.iter_timed_pulses(csp_rate, total_time, block_size, seed, workers, total_pulses)
+        else:
+            blocks = self.iter_pulses(total_pulses, block_size, seed, workers)
+
+        writer = PulseWriter(filename,
+                             head="CHT" if timed else "CHP",
+                             channels=self.channels,
+                             total_time=total_time,
+                             energyX_a=self.energyX_a,
+                             energyX_b=self.energyX_b,
+                             timestamp=timestamp)
+        done = 0
+        with writer:
+            for block in blocks:
+                writer.write(block)
+                done += len(block)
+                if callback is not None and callback(done, total_pulses, writer.written) is False:
+                    blocks.close()
+                    writer.abort()
+                    return None
+
+        return writer.written
+
+    def load_pulse_info(self, pulses, start=0, total_time=None):
+        """
+        从核脉冲对象复制道数、测量时间、能量刻度与起始时间等信息
+
+        :param pulses: Pulses
+        :param start: float, 能谱对应的时间窗口起点(s)，用于推算起始时间
+        :param total_time: float, 能谱对应的测量时间(s)，默认为脉冲文件的测量时间
+        :return: MCA
+        """
+        if total_time is None:
+            total_time = pulses.total_time
+        self.channels = pulses.channels
+        self.total_time = total_time
+        self.live_time = int(round(self.total_time * 50))
+        self.real_time = int(round(self.total_time * 50))
+        self.energyX_a = pulses.energyX_a
+        self.energyX_b = pulses.energyX_b
+        self.timestamp = pulses.timestamp + int(start * 1000)
+        self.start_time_hhmm = time.strftime("%H%M", time.localtime(self.timestamp / 1000)).encode()
+        self.start_time_ss = time.strftime("%S", time.localtime(self.timestamp / 1000)).encode()
+        self.start_date = time.strftime("%d", time.localtime(self.timestamp / 1000)).encode()
+        self.start_date += DICT_DATE[int(time.strftime("%m", time.localtime(self.timestamp / 1000)))].encode()
+        self.start_date += time.strftime("%y1", time.localtime(self.timestamp / 1000)).encode()
+        self.mca_detector_id = 256
+        self.segment_number = 2
 
-        elif isinstance(pulses, Pulses):
-            self.channels = pulses.channels
-            self.total_time = pulses.total_time
-            self.live_time = self.total_time * 50
-            self.real_time = self.total_time * 50
-            self.energyX_a = pulses.energyX_a
-            self.energyX_b = pulses.energyX_b
-            self.timestamp = pulses.timestamp
-            self.start_time_hhmm = time.strftime("%H%M", time.localtime(self.timestamp / 1000)).encode()
-            self.start_time_ss = time.strftime("%S", time.localtime(self.timestamp / 1000)).encode()
-            self.start_date = time.strftime("%d", time.localtime(self.timestamp / 1000)).encode()
-            self.start_date += DICT_DATE[int(time.strftime("%m", time.localtime(self.timestamp / 1000)))].encode()
-            self.start_date += time.strftime("%y1", time.localtime(self.timestamp / 1000)).encode()
-            res = np.zeros(self.channels, dtype=np.int32)
+        return self
 
-            if pulses.data.ndim == 1:
-                for ele in pulses:
-                    res[ele] += 1
-            elif pulses.data.ndim == 2:
-                for ele in pulses.data[:, 0]:
-                    res[ele] += 1
+    def from_pulses(self, pulses, max_channel=1024, start=None, end=None):
+        """
+        由核脉冲统计能谱
+
+        :param pulses: Pulses / str 脉冲文件名 / list, tuple, np.ndarray 道址
+        :param max_channel: int, 输入为道址数组时的道数
+        :param start: float, 仅统计绝对时间在 [start, end) 内的脉冲(s)，需要带时间间隔的脉冲
+        :param end: float, 同上，默认为全部脉冲的时长
+        :return: MCA
+        """
+        if isinstance(pulses, list) or isinstance(pulses, tuple) or isinstance(pulses, np.ndarray):
+            res, self.out_of_range = histogram_pulses(np.asarray(pulses), max_channel)
+            self.data = res.astype(np.float64)
 
+        elif isinstance(pulses, Pulses):
+            if start is None and end is None:
+                self.load_pulse_info(pulses)
+                res, self.out_of_range = histogram_pulses(pulses.data, self.channels)
+            else:
+                if pulses.data.ndim != 2:
+                    raise TypeError("核脉冲数据不含时间间隔，无法按时间切分")
+                if start is None:
+                    start = 0
+                if end is None:
+                    end = pulses.get_duration()
+                self.load_pulse_info(pulses, start, end - start)
+                res, out_of_range = histogram_time_windows(pulses.data, self.channels, (start, end))
+                res = res[0]
+                self.out_of_range = int(out_of_range[0])
             self.data = res.astype(np.float64)
 
         elif isinstance(pulses, str):
             filename = pulses
-            pulses = Pulses(filename)
-            self.from_pulses(pulses)
+            pulses = Pulses(filename, mmap=True)
+            self.from_pulses(pulses, start=start, end=end)
 
         self.mca_detector_id = 256
         self.segment_number = 2
@@ -551,17 +1098,20 @@ class MCA(object):
 
 class Pulses(object):
 
-    def __init__(self, data=None):
+    def __init__(self, data=None, mmap=False, verify="sync", on_corrupt=None):
+        self.__abs_time = None
         self.data = data
+        self.filename = None
         self.channels = 1024
         self.total_time = 0
         self.energyX_a = 0
         self.energyX_b = 0
         self.timestamp = 0
+        self.checksum_verifier = None
 
         if isinstance(data, str):
             filename = data
-            self.from_file(filename)
+            self.from_file(filename, mmap, verify, on_corrupt)
 
     def __iter__(self, **kwargs):
         return self.data.__iter__(**kwargs)
@@ -574,120 +1124,368 @@ class Pulses(object):
 
     def __setitem__(self, key, value):
         self.data[key] = value
+        self.__abs_time = None
+
+    @property
+    def data(self):
+        return self.__data
+
+    @data.setter
+    def data(self, value):
+        self.__data = value
+        self.__abs_time = None
 
-    def get_abs_time(self):
+    def get_abs_time(self, cache=True, interrupted=None):
+        """
+        各脉冲的绝对时间，即该脉冲之前所有时间间隔之和
+
+        :param cache: bool, 缓存计算结果，data 被替换或通过下标修改后自动失效
+        :param interrupted: callable, 每块计算前调用，返回True时放弃计算并返回None
+        :return: np.ndarray(float64), 绝对时间(s)，无时间间隔或被中止时返回None
+        """
         if self.data.ndim == 1:
             return
-        time_i = 0
-        time_abs = np.zeros(len(self.data), dtype=np.float64)
-        for i, ele in enumerate(self.data[:, 1]):
-            time_abs[i] = time_i
-            time_i += ele / 10 ** 6
+        if self.__abs_time is not None:
+            return self.__abs_time
 
+        # 以整数微秒分块累加，避免浮点累积误差与完整的int64中间数组
+        time_abs = np.empty(len(self.data), dtype=np.float64)
+        time_i = 0
+        for i in range(0, len(self.data), PULSE_BLOCK_SIZE):
+            if interrupted is not None and interrupted():
+                return
+            intervals = self.data[i:i + PULSE_BLOCK_SIZE, 1].astype(np.int64)
+            block = np.cumsum(intervals)
+            block += time_i - intervals
+            time_i = int(block[-1] + intervals[-1])
+            time_abs[i:i + PULSE_BLOCK_SIZE] = block
+        time_abs /= 10 ** 6
+
+        if cache:
+            self.__abs_time = time_abs
         return time_abs
 
-    def from_file(self, filename):
-        if filename[-3:] == "tps":  # 自定义的核脉冲数据文件
+    def from_file(self, filename, mmap=False, verify="sync", on_corrupt=None):
+        """
+        读取 .tps 核脉冲文件
+
+        :param filename: str, 文件名
+        :param mmap: bool, 以只读内存映射方式打开，脉冲数据按需从磁盘换入
+        :param verify: str, 校验方式，见 verify_file
+        :param on_corrupt: callable, 后台校验失败回调 on_corrupt(filename)
+        :return: Pulses
+        """
+        if os.path.splitext(filename)[1].lower() != ".tps":
+            raise TypeError("错误的文件类型")
+        self.filename = filename
+
+        # 自定义的核脉冲数据文件
+        if mmap:
+            with open(filename, "rb") as f:
+                data = f.read(PULSE_HEAD_SIZE)
+                f.close()
+        else:
             with open(filename, "rb") as f:
                 data = f.read()
                 f.close()
-            head = data[0:3]  # 3B 文件头标识CHP
-            if head in (b"CHP", b"CHT"):
-                head = head.decode()
-            else:
-                raise TypeError("错误的文件类型")
+        head = data[0:3]  # 3B 文件头标识CHP
+        if head in (b"CHP", b"CHT"):
+            head = head.decode()
+        else:
+            raise TypeError("错误的文件类型")
 
-            ts = data[3:9]  # 6B 时间戳（单位ms）
-            self.timestamp = int().from_bytes(ts, "little", signed=False)
+        ts = data[3:9]  # 6B 时间戳（单位ms）
+        self.timestamp = int().from_bytes(ts, "little", signed=False)
 
-            channels = data[9:11]  # 2B channel分辨率
-            self.channels = int().from_bytes(channels, "little", signed=False)
+        channels = data[9:11]  # 2B channel分辨率
+        self.channels = int().from_bytes(channels, "little", signed=False)
 
-            total_time = data[11:14]  # 3B 测量时间（单位s）
-            self.total_time = int().from_bytes(total_time, "little", signed=False)
-            # print(self.total_time)
-            # print(self.__len__)
+        total_time = data[11:14]  # 3B 测量时间（单位s）
+        self.total_time = int().from_bytes(total_time, "little", signed=False)
 
-            enX_a = data[14:18]  # 4B 能量刻度参数A
-            # print(enX_a)
-            self.energyX_a = struct.unpack("f", enX_a)[0]
+        enX_a = data[14:18]  # 4B 能量刻度参数A
+        self.energyX_a = struct.unpack("f", enX_a)[0]
 
-            enX_b = data[18:22]  # 4B 能量刻度参数B
-            self.energyX_b = struct.unpack("f", enX_b)[0]
-            # print(self.energyX_a)
+        enX_b = data[18:22]  # 4B 能量刻度参数B
+        self.energyX_b = struct.unpack("f", enX_b)[0]
 
-            sha = data[22:54]  # 32B 全文除此字段的sha256校验和
-            hasher = hashlib.sha256()
-            hasher.update(data[:22])
-            hasher.update(data[54:])
-            if sha != hasher.digest():
-                raise Exception("文件损坏")
+        sha = data[22:54]  # 32B 全文除此字段的sha256校验和
+        if mmap:
+            self.checksum_verifier = verify_file(filename, sha, None, verify, on_corrupt)
+        else:
+            self.checksum_verifier = verify_file(filename, sha, data, verify, on_corrupt)
 
+        if mmap:
+            length = (os.path.getsize(filename) - PULSE_HEAD_SIZE) // 4
+            if length:
+                self.data = np.memmap(filename, dtype=np.uint32, mode="r",
+                                      offset=PULSE_HEAD_SIZE, shape=(length,))
+            else:
+                self.data = np.zeros(0, dtype=np.uint32)
+        else:
             data = data[54:]  # 4N*B 脉冲数据
             self.data = np.frombuffer(data, dtype=np.uint32)
             length = len(self.data)
-            if head == "CHT":
-                self.data = np.reshape(self.data, (length // 2, 2))
+        if head == "CHT":
+            self.data = np.reshape(self.data, (length // 2, 2))
 
-            return self
+        return self
 
-    def to_mca(self):
-        return MCA().from_pulses(self)
+    def get_duration(self):
+        """
+        全部脉冲时间间隔之和
+
+        :return: float, 时长(s)
+        """
+        if self.data.ndim != 2:
+            raise TypeError("核脉冲数据不含时间间隔")
+        total = 0
+        for i in range(0, len(self.data), PULSE_BLOCK_SIZE):
+            total += int(self.data[i:i + PULSE_BLOCK_SIZE, 1].sum(dtype=np.uint64))
+
+        return total / 10 ** 6
+
+    def to_mca(self, start=None, end=None):
+        return MCA().from_pulses(self, start=start, end=end)
+
+    def to_mca_windows(self, window=None, edges=None):
+        """
+        一次遍历按时间窗口切分出多个能谱
+
+        :param window: float, 等长窗口宽度(s)，从0开始覆盖全部脉冲
+        :param edges: list, 单调递增的窗口边界(s)，第i个窗口为 [edges[i], edges[i+1])，优先于window
+        :return: list of MCA
+        """
+        if self.data.ndim != 2:
+            raise TypeError("核脉冲数据不含时间间隔，无法按时间切分")
+        if edges is None and window is None:
+            raise TypeError("未指定时间窗口宽度或边界")
+        if edges is None:
+            if not (np.isfinite(window) and window > 0):
+                raise ValueError("时间窗口宽度必须为正数: {}".format(window))
+            duration = self.get_duration()
+            edges = np.arange(0, duration + window, window, dtype=np.float64)
+            if edges[-1] <= duration:
+                edges = np.append(edges, edges[-1] + window)
+        edges = np.asarray(edges, dtype=np.float64)
+        if edges.ndim != 1 or len(edges) < 2:
+            raise ValueError("时间窗口边界至少需要2个值")
+        if not np.all(np.isfinite(edges)) or edges[0] < 0:
+            raise ValueError("时间窗口边界必须为非负有限值")
+        if np.any(np.diff(edges) <= 0):
+            raise ValueError("时间窗口边界必须严格递增")
+
+        res, out_of_range = histogram_time_windows(self.data, self.channels, edges)
+
+        ret = []
+        for i, ele in enumerate(res):
+            mca = MCA(ele)
+            mca.load_pulse_info(self, edges[i], edges[i + 1] - edges[i])
+            mca.out_of_range = int(out_of_range[i])
+            ret.append(mca)
 
-    def to_file(self, filename):
-        data = b""
+        return ret
 
+    def to_file(self, filename):
         if self.data.ndim == 1:
             head = "CHP"
         elif self.data.ndim == 2:
             head = "CHT"
         else:
             head = "UNO"
-        head = head.encode()
-        data += head
-
-        ts = self.timestamp.to_bytes(6, "little", signed=False)
-        data += ts
-
-        channels = self.channels.to_bytes(2, "little", signed=False)
-        data += channels
 
         total_time = self.total_time
-        if head == b"CHT" and not self.total_time:
+        if head == "CHT" and not self.total_time:
             total_time = self.data[:, 1].sum() / 1000000
             if total_time % 1:
                 total_time = total_time // 1 + 1
 
-        total_time = int(total_time).to_bytes(3, "little", signed=False)
-        data += total_time
+        writer = PulseWriter(filename,
+                             head=head,
+                             channels=self.channels,
+                             total_time=total_time,
+                             energyX_a=self.energyX_a,
+                             energyX_b=self.energyX_b,
+                             timestamp=self.timestamp)
+        with writer:
+            for i in range(0, len(self.data), PULSE_BLOCK_SIZE):
+                writer.write(self.data[i:i + PULSE_BLOCK_SIZE])
+
+        return writer.written
+
+
+class IntervalHistogram(object):
+
+    def __init__(self, t_max=None, divs=1000, log_scale=False, t_min=1):
+        """
+        脉冲时间间隔直方图，可多次 update 逐块累加。
+        第i个区间为 (edges[i], edges[i+1]]，线性区间 edges[i] = dt*i，对数区间 edges[i] = t_min*exp(step*i)，
+        edges[0] 为0，时间间隔为0的脉冲不计入。
+        超出范围的时间间隔不会被丢弃：dt（对数区间为 step）加倍，相邻区间两两合并，
+        直到范围覆盖该间隔，合并前后的区间边界逐位重合，已累加的计数与重新统计的结果相同
+
+        :param t_max: float, 初始最大时间间隔(us)，为None时取第一块的最大值
+        :param divs: int, 区间数
+        :param log_scale: bool, 对数等分区间
+        :param t_min: float, 对数区间的最小边界(us)
+        """
+        self.t_max = None
+        self.divs = divs
+        self.log_scale = log_scale
+        self.t_min = t_min
+        self.step = None
+        self.edges = None
+        self.counts = np.zeros(divs, dtype=np.int64)
+        if t_max is not None:
+            self.__set_range(t_max)
+
+    def __set_step(self, step):
+        self.step = step
+        i = np.arange(self.divs + 1, dtype=np.float64)
+        if self.log_scale:
+            self.edges = self.t_min * np.exp(step * i)
+            self.edges[0] = 0
+        else:
+            self.edges = step * i
+        self.t_max = self.edges[-1]
 
-        enX_a = struct.pack("f", self.energyX_a)
-        # print(enX_a)
-        # print(self.energyX_a)
-        data += enX_a
+    def __set_range(self, t_max):
+        if self.log_scale:
+            step = np.log(max(t_max, self.t_min) / self.t_min) / self.divs
+        else:
+            step = t_max / self.divs
+        self.__set_step(step)
+        # 舍入可能使最后一个边界略小于 t_max，此时把 step 调大一个最小单位
+        while self.edges[-1] < t_max:
+            self.__set_step(np.nextafter(self.step, np.inf))
+
+    def __grow(self, t):
+        """
+        相邻区间两两合并，直到范围覆盖 t
+        """
+        while self.edges[-1] < t:
+            if self.step:
+                self.__set_step(2 * self.step)
+            else:
+                # 对数区间的 t_max 不大于 t_min 时只有第一个区间有计数
+                self.__set_step(np.log(2) / self.divs if self.log_scale else t / self.divs)
+            merged = np.zeros(self.divs, dtype=np.int64)
+            np.add.at(merged, np.arange(self.divs) // 2, self.counts)
+            self.counts = merged
+
+    def update(self, times):
+        """
+        累加一块时间间隔
+
+        :param times: np.ndarray, 时间间隔(us)
+        :return: IntervalHistogram
+        """
+        times = np.asarray(times, dtype=np.float64)
+        times = times[times > 0]
+        if not len(times):
+            return self
+        t_max = times.max()
+        if self.t_max is None:
+            self.__set_range(t_max)
+        elif t_max > self.edges[-1]:
+            self.__grow(t_max)
 
-        enX_b = struct.pack("f", self.energyX_b)
-        data += enX_b
+        index = np.searchsorted(self.edges, times, side="left") - 1
+        index = np.clip(index, 0, self.divs - 1)
+        self.counts += np.bincount(index, minlength=self.divs)
 
-        data_raw = self.data.astype(np.uint32).tobytes()
+        return self
 
-        sha = hashlib.sha256()
-        sha.update(data)
-        sha.update(data_raw)
-        sha = sha.digest()
-        data += sha
+    def result(self):
+        """
+        :return: x(毫秒), y概率
+        """
+        if self.t_max is None:
+            return np.zeros(self.divs), np.zeros(self.divs)
+        if self.log_scale:
+            x = self.edges[:-1] / 1000
+        else:
+            x = np.linspace(0, self.t_max / 1000, self.divs)
+        y = self.counts.astype(np.float64)
+        total = y.sum()
+        if total:
+            y /= total
+
+        return x, y
+
+
+class PulseWriter(object):
+
+    def __init__(self, filename, head="CHP", channels=1024, total_time=0,
+                 energyX_a=0, energyX_b=0, timestamp=0):
+        """
+        .tps 核脉冲文件流式写入器，逐块写入脉冲数据并增量计算sha256校验和
+
+        :param filename: str, 目标文件名，无.tps后缀时自动补全
+        :param head: str, 文件头标识 CHP(无时间)/CHT(带时间间隔)
+        :param channels: int, channel分辨率
+        :param total_time: float, 测量时间(s)
+        :param energyX_a: float, 能量刻度参数A
+        :param energyX_b: float, 能量刻度参数B
+        :param timestamp: int, 时间戳(ms)
+        """
+        if "." not in filename or filename.split(".")[-1].lower() != "tps":
+            filename += ".tps"
+        self.filename = filename
 
-        data += data_raw
+        data = head.encode()  # 3B 文件头标识
+        data += timestamp.to_bytes(6, "little", signed=False)  # 6B 时间戳（单位ms）
+        data += channels.to_bytes(2, "little", signed=False)  # 2B channel分辨率
+        data += int(total_time).to_bytes(3, "little", signed=False)  # 3B 测量时间（单位s）
+        data += struct.pack("f", energyX_a)  # 4B 能量刻度参数A
+        data += struct.pack("f", energyX_b)  # 4B 能量刻度参数B
 
-        if "." not in filename or filename.split(".")[-1] != "tps":
-            filename += ".tps"
+        self.hasher = hashlib.sha256()
+        self.hasher.update(data)
 
-        with open(filename, "wb") as f:
-            ret = f.write(data)
-            f.close()
+        self.file = open(filename, "wb")
+        # 32B sha256校验和在写入完成后回填
+        self.written = self.file.write(data + bytes(32))
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, block):
+        """
+        写入一块脉冲数据
+
+        :param block: np.ndarray, 1维道址或 N×2 [道址, 时间间隔]
+        :return: int, 本次写入的字节数
+        """
+        data_raw = np.ascontiguousarray(block).astype(np.uint32).tobytes()
+        self.hasher.update(data_raw)
+        ret = self.file.write(data_raw)
+        self.written += ret
         return ret
 
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.seek(22)
+        self.file.write(self.hasher.digest())
+        self.file.close()
+
+    def abort(self):
+        """
+        中止写入并删除未完成的文件，避免留下校验和有效的残缺文件
+        """
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
 if __name__ == '__main__':
     mca = MCA("")
     mca
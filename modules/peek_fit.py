@@ -0,0 +1,433 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Author: i2cy(i2cy@outlook.com)
+# Project: main.py
+# Filename: peek_fit
+# Created on: 2026/10/18
+
+import numpy as np
+from .mca import MCA
+from .find_peek import PeekFinder, ragged_indices, segment_reduce
+
+FWHM_FACTOR = 2 * np.sqrt(2 * np.log(2))
+SQRT2 = np.sqrt(2)
+SQRT2PI = np.sqrt(2 * np.pi)
+
+# 一个峰的拟合结果
+FIT_RESULT_DTYPE = np.dtype([
+    ("centroid", np.float64),
+    ("centroid_err", np.float64),
+    ("fwhm", np.float64),
+    ("fwhm_err", np.float64),
+    ("area", np.float64),
+    ("area_err", np.float64),
+    ("height", np.float64),
+    ("multiplet", np.int64),
+    ("chi2", np.float64),
+    ("converged", np.bool_),
+])
+
+BACKGROUNDS = ("linear", "step")
+CUT_PASSES = 2  # 长链切开后固定相邻峰形状再拟合的轮数
+
+
+def erfc(x):
+    """
+    互补误差函数，Abramowitz-Stegun 7.1.26 有理近似，绝对误差小于 1.5e-7
+
+    :param x: np.ndarray
+    :return: np.ndarray(float64)
+    """
+    z = np.abs(x)
+    t = 1 / (1 + 0.3275911 * z)
+    ret = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    ret *= np.exp(-z * z)
+    return np.where(x >= 0, ret, 2 - ret)
+
+
+def multiplet_model(params, x, xc, npk, jacobian=True):
+    """
+    多峰模型：sum(A * (g + h * e)) + b0 + b1 * (x - xc)，
+    g 为高斯峰，e 为高斯峰对应的台阶 0.5 * erfc((x - mu) / (sqrt(2) * sigma))，台阶高度与峰高成正比
+
+    :param params: np.ndarray (拟合组数, 3 + 3 * npk), 依次为 b0, b1, h, A..., mu..., sigma...
+    :param x: np.ndarray (拟合组数, 点数), 道址
+    :param xc: np.ndarray (拟合组数, 1), 线性本底的参考道址
+    :param npk: int, 每组的峰数
+    :param jacobian: bool, 同时返回解析雅可比矩阵
+    :return: np.ndarray (拟合组数, 点数) 或 (模型值, np.ndarray (拟合组数, 点数, 参数数) 雅可比矩阵)
+    """
+    height = params[:, 3:3 + npk, None]
+    mu = params[:, 3 + npk:3 + 2 * npk, None]
+    sigma = params[:, 3 + 2 * npk:, None]
+    h = params[:, 2, None, None]
+
+    d = x[:, None, :] - mu
+    g = np.exp(-d ** 2 / (2 * sigma ** 2))
+    e = 0.5 * erfc(d / (SQRT2 * sigma))
+
+    ret = params[:, 0, None] + params[:, 1, None] * (x - xc) + (height * (g + h * e)).sum(axis=1)
+    if not jacobian:
+        return ret
+
+    # de/dmu = g / (sqrt(2pi) * sigma), de/dsigma = de/dmu * d / sigma
+    t = g / (SQRT2PI * sigma)
+    jac = np.empty(x.shape + (params.shape[1],), dtype=np.float64)
+    jac[:, :, 0] = 1
+    jac[:, :, 1] = x - xc
+    jac[:, :, 2] = (height * e).sum(axis=1)
+    jac[:, :, 3:3 + npk] = (g + h * e).transpose(0, 2, 1)
+    jac[:, :, 3 + npk:3 + 2 * npk] = (height * (g * d / sigma ** 2 + h * t)).transpose(0, 2, 1)
+    jac[:, :, 3 + 2 * npk:] = (height * (g * d ** 2 / sigma ** 3 + h * t * d / sigma)).transpose(0, 2, 1)
+
+    return ret, jac
+
+
+def levenberg_marquardt(params, x, y, weights, xc, npk, active, lower, upper, max_iter=100, tol=1e-4):
+    """
+    向量化 Levenberg-Marquardt，所有拟合组同时迭代，各组独立调整阻尼系数
+
+    :param params: np.ndarray (拟合组数, 参数数), 初值
+    :param x: np.ndarray (拟合组数, 点数), 道址
+    :param y: np.ndarray (拟合组数, 点数), 计数
+    :param weights: np.ndarray (拟合组数, 点数), 权重（1/方差），补齐的点为0
+    :param xc: np.ndarray (拟合组数, 1), 线性本底的参考道址
+    :param npk: int, 每组的峰数
+    :param active: np.ndarray(bool) (参数数,) 或 (拟合组数, 参数数), 参与拟合的参数
+    :param lower: np.ndarray (拟合组数, 参数数), 参数下限
+    :param upper: np.ndarray (拟合组数, 参数数), 参数上限
+    :param max_iter: int, 最大迭代次数
+    :param tol: float, chi2 相对下降量小于该值时认为收敛
+    :return: (np.ndarray 参数, np.ndarray 协方差矩阵, np.ndarray 约化chi2, np.ndarray(bool) 是否收敛)
+    """
+    params = np.clip(params, lower, upper)
+    nfit, nparam = params.shape
+    sqrt_w = np.sqrt(weights)
+    active = np.broadcast_to(active, params.shape)
+    fixed = (~active)[:, :, None] * np.eye(nparam)
+
+    def evaluate(p, rows):
+        f, jac = multiplet_model(p, x[rows], xc[rows], npk)
+        res = (y[rows] - f) * sqrt_w[rows]
+        jac *= sqrt_w[rows][:, :, None] * active[rows][:, None, :]
+        return res, jac, (res ** 2).sum(axis=1)
+
+    res, jac, chi2 = evaluate(params, slice(None))
+    lam = np.full(nfit, 1e-3)
+    done = np.zeros(nfit, dtype=bool)
+
+    for _ in range(max_iter):
+        # 只对尚未收敛的组继续迭代
+        live = np.flatnonzero(~done)
+        if not len(live):
+            break
+
+        jac_live = jac[live]
+        jac_t = jac_live.transpose(0, 2, 1)
+        jtj = jac_t @ jac_live
+        grad = (jac_t @ res[live][:, :, None])[:, :, 0]
+        diag = np.diagonal(jtj, axis1=1, axis2=2)
+        damped = jtj + (lam[live][:, None] * diag + 1e-12)[:, :, None] * np.eye(nparam) + fixed[live]
+        step = np.linalg.solve(damped, grad[:, :, None])[:, :, 0]
+
+        trial = np.clip(params[live] + step, lower[live], upper[live])
+        res_trial, jac_trial, chi2_trial = evaluate(trial, live)
+
+        better = chi2_trial < chi2[live]
+        rows = live[better]
+        converged = chi2[rows] - chi2_trial[better] <= tol * chi2_trial[better]
+        params[rows] = trial[better]
+        res[rows], jac[rows], chi2[rows] = res_trial[better], jac_trial[better], chi2_trial[better]
+        done[rows[converged]] = True
+
+        lam[live] = np.clip(np.where(better, lam[live] / 10, lam[live] * 10), 1e-12, 1e12)
+        # 阻尼已到上限仍无法下降，说明已处于极小值
+        done[live[lam[live] >= 1e12]] = True
+
+    dof = np.maximum((weights > 0).sum(axis=1) - active.sum(axis=1), 1)
+    chi2_red = chi2 / dof
+    jtj = jac.transpose(0, 2, 1) @ jac + fixed
+    cov = np.linalg.pinv(jtj) * np.maximum(chi2_red, 1)[:, None, None]
+    cov *= active[:, :, None] & active[:, None, :]
+
+    return params, cov, chi2_red, done
+
+
+def estimate_sigma(data, positions, left, right):
+    """
+    由半高宽粗估各峰的标准差，作为拟合初值
+
+    :param data: np.ndarray, 各道计数
+    :param positions: np.ndarray(float64), 峰位
+    :param left: np.ndarray, 左边界
+    :param right: np.ndarray, 右边界
+    :return: np.ndarray(float64)
+    """
+    top = np.clip(np.round(positions).astype(np.int64), 0, len(data) - 1)
+    e0 = np.clip(np.asarray(left).astype(np.int64), 0, top)
+    e1 = np.clip(np.asarray(right).astype(np.int64), top, len(data) - 1)
+
+    base = np.minimum(data[e0], data[e1])
+    half_hight = base + (data[top] - base) / 2
+
+    idx, offsets, lengths = ragged_indices(e0, top + 1)
+    hit = np.where(data[idx] <= np.repeat(half_hight, lengths), idx, -1)
+    q = segment_reduce(np.maximum, hit, offsets, lengths, -1)
+    left_half = np.where(q >= 0, q + 0.5, e0)
+
+    idx, offsets, lengths = ragged_indices(top, e1 + 1)
+    hit = np.where(data[idx] <= np.repeat(half_hight, lengths), idx, len(data))
+    q = segment_reduce(np.minimum, hit, offsets, lengths, len(data))
+    right_half = np.where(q < len(data), q - 0.5, e1)
+
+    ret = np.maximum(right_half - left_half, 1) / FWHM_FACTOR
+    return np.clip(ret, 0.5, np.maximum((e1 - e0) / 2, 1))
+
+
+def group_multiplets(positions, sigma, channels, span=4.0, max_peaks=8):
+    """
+    按峰位 ± span 倍标准差划定拟合区间，区间重叠的峰连成一条链，归为同一多重峰；
+    链上超过 max_peaks 个峰时在相邻峰间距最大处反复切开，
+    直到每段不超过 max_peaks 个峰
+
+    :param positions: np.ndarray(float64), 峰位
+    :param sigma: np.ndarray(float64), 标准差初值
+    :param channels: int, 道数
+    :param span: float, 拟合区间半宽（标准差倍数）
+    :param max_peaks: int, 一个多重峰最多包含的峰数
+    :return: (np.ndarray 各峰所属多重峰编号, np.ndarray 各多重峰起始道, np.ndarray 各多重峰终止道（含）,
+              np.ndarray 各多重峰所属链的编号，同一链被切成多段时编号相同)
+    """
+    order = np.argsort(positions, kind="stable")
+    lo = np.clip(np.floor(positions - span * sigma).astype(np.int64) - 1, 0, channels - 1)[order]
+    hi = np.clip(np.ceil(positions + span * sigma).astype(np.int64) + 1, 0, channels - 1)[order]
+
+    reach = np.maximum.accumulate(hi)
+    chain_start = np.ones(len(order), dtype=bool)
+    chain_start[1:] = lo[1:] > reach[:-1]
+    start = chain_start.copy()
+
+    # 过长的链在最宽的间隔处切开，少数长链逐条处理
+    bounds = np.append(np.flatnonzero(chain_start), len(order))
+    gap = np.diff(positions[order])
+    stack = [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b - a > max_peaks]
+    while stack:
+        a, b = stack.pop()
+        cut = a + 1 + int(np.argmax(gap[a:b - 1]))
+        start[cut] = True
+        stack.extend(ele for ele in ((a, cut), (cut, b)) if ele[1] - ele[0] > max_peaks)
+
+    group = np.cumsum(start) - 1
+    chain = np.cumsum(chain_start) - 1
+
+    ret = np.empty(len(order), dtype=np.int64)
+    ret[order] = group
+    starts = np.flatnonzero(start)
+    if not len(starts):
+        return ret, lo[:0], hi[:0], chain[:0]
+    return ret, lo[starts], np.maximum.reduceat(hi, starts), chain[starts]
+
+
+def fit_multiplets(spectra, bucket, npk, results, shapes, fix_neighbours=False, background="linear",
+                   max_iter=100, tol=1e-4):
+    """
+    峰数同为 npk 的多重峰补齐到相同点数后同时拟合，结果写入 results；
+    长链切开处同链其他段的相邻峰作为附加项一起拟合，只写回本段峰的结果
+
+    :param spectra: list, fit_peeks_batch 整理出的各能谱数据
+    :param bucket: list of (能谱序号, 多重峰编号, 本段峰序号数组, 相邻峰序号数组)，两数组长度之和为 npk
+    :param npk: int, 每个拟合组的峰数（含相邻峰）
+    :param results: list of np.ndarray(FIT_RESULT_DTYPE), 各能谱的拟合结果
+    :param shapes: list of (np.ndarray 峰位, np.ndarray 标准差, np.ndarray 峰高), 各能谱相邻峰项的初值
+    :param fix_neighbours: bool, 相邻峰的峰位与标准差固定为 shapes 中的值，只拟合峰高
+    :param background: str, "linear" 线性本底，"step" 线性本底加台阶
+    :param max_iter: int, 最大迭代次数
+    :param tol: float, chi2 相对下降量小于该值时认为收敛
+    """
+    nfit = len(bucket)
+    nparam = 3 + 3 * npk
+    spans = np.array([spectra[i][5][g] - spectra[i][4][g] + 1 for i, g, _, _ in bucket])
+    npoint = spans.max()
+
+    x = np.empty((nfit, npoint), dtype=np.float64)
+    y = np.zeros((nfit, npoint), dtype=np.float64)
+    weights = np.zeros((nfit, npoint), dtype=np.float64)
+    xc = np.empty((nfit, 1), dtype=np.float64)
+    params = np.zeros((nfit, nparam), dtype=np.float64)
+    lower = np.empty((nfit, nparam), dtype=np.float64)
+    upper = np.empty((nfit, nparam), dtype=np.float64)
+    active = np.ones((nfit, nparam), dtype=bool)
+    active[:, 2] = background == "step"
+
+    for row, (i, g, peek_index, neighbour_index) in enumerate(bucket):
+        data, positions, sigma = spectra[i][:3]
+        lo, hi = spectra[i][4][g], spectra[i][5][g]
+        n = hi - lo + 1
+        own = len(peek_index)
+
+        x[row] = lo + np.minimum(np.arange(npoint), n - 1)
+        y[row, :n] = data[lo:hi + 1]
+        weights[row, :n] = 1 / np.maximum(data[lo:hi + 1], 1)
+        xc[row] = (lo + hi) / 2
+
+        # 本底初值取区间两端（扣除相邻峰后）的连线
+        counts = data[lo:hi + 1]
+        if len(neighbour_index):
+            nb_mu, nb_sigma, nb_height = (ele[neighbour_index, None] for ele in shapes[i])
+            d = np.arange(lo, hi + 1) - nb_mu
+            counts = counts - (nb_height * np.exp(-d ** 2 / (2 * nb_sigma ** 2))).sum(axis=0)
+        y_lo = counts[:2].mean()
+        y_hi = counts[-2:].mean()
+        slope = (y_hi - y_lo) / max(hi - lo, 1)
+        mu = positions[peek_index]
+        top = counts[np.clip(np.round(mu).astype(np.int64), lo, hi) - lo]
+
+        params[row, 0] = (y_lo + y_hi) / 2
+        params[row, 1] = slope
+        params[row, 3:3 + own] = np.maximum(top - (params[row, 0] + slope * (mu - xc[row])), 1)
+        params[row, 3 + npk:3 + npk + own] = mu
+        params[row, 3 + 2 * npk:3 + 2 * npk + own] = sigma[peek_index]
+
+        lower[row, :3] = -np.inf
+        upper[row, :3] = np.inf
+        lower[row, 3:3 + npk] = 0
+        upper[row, 3:3 + npk] = np.inf
+        lower[row, 3 + npk:3 + 2 * npk] = lo
+        upper[row, 3 + npk:3 + 2 * npk] = hi
+        lower[row, 3 + 2 * npk:] = 0.3
+        upper[row, 3 + 2 * npk:] = max(n / 2, 0.3)
+
+        # 相邻峰：首轮在寻峰结果附近自由拟合，之后各轮形状固定、只拟合峰高
+        mu, sigma, height = (ele[neighbour_index] for ele in shapes[i])
+        params[row, 3 + own:3 + npk] = height
+        params[row, 3 + npk + own:3 + 2 * npk] = mu
+        params[row, 3 + 2 * npk + own:] = sigma
+        if fix_neighbours:
+            lower[row, 3 + npk + own:3 + 2 * npk] = upper[row, 3 + npk + own:3 + 2 * npk] = mu
+            lower[row, 3 + 2 * npk + own:] = upper[row, 3 + 2 * npk + own:] = sigma
+            active[row, 3 + npk + own:3 + 2 * npk] = False
+            active[row, 3 + 2 * npk + own:] = False
+        else:
+            lower[row, 3 + npk + own:3 + 2 * npk] = mu - sigma
+            upper[row, 3 + npk + own:3 + 2 * npk] = mu + sigma
+            lower[row, 3 + 2 * npk + own:] = sigma / 2
+            upper[row, 3 + 2 * npk + own:] = sigma * 2
+
+    params, cov, chi2_red, converged = levenberg_marquardt(params, x, y, weights, xc, npk, active,
+                                                           lower, upper, max_iter, tol)
+
+    height = params[:, 3:3 + npk]
+    sigma = params[:, 3 + 2 * npk:]
+    var = np.diagonal(cov, axis1=1, axis2=2)
+    var_height = var[:, 3:3 + npk]
+    var_mu = var[:, 3 + npk:3 + 2 * npk]
+    var_sigma = var[:, 3 + 2 * npk:]
+    cov_hs = cov[:, np.arange(3, 3 + npk), np.arange(3 + 2 * npk, 3 + 3 * npk)]
+
+    # 净面积 = A * sigma * sqrt(2pi)，误差按一阶传递
+    area = height * sigma * SQRT2PI
+    area_var = SQRT2PI ** 2 * (sigma ** 2 * var_height + height ** 2 * var_sigma + 2 * height * sigma * cov_hs)
+
+    for row, (i, g, peek_index, neighbour_index) in enumerate(bucket):
+        own = len(peek_index)
+        ret = results[i][peek_index]
+        ret["centroid"] = params[row, 3 + npk:3 + npk + own]
+        ret["centroid_err"] = np.sqrt(np.maximum(var_mu[row, :own], 0))
+        ret["fwhm"] = FWHM_FACTOR * sigma[row, :own]
+        ret["fwhm_err"] = FWHM_FACTOR * np.sqrt(np.maximum(var_sigma[row, :own], 0))
+        ret["area"] = area[row, :own]
+        ret["area_err"] = np.sqrt(np.maximum(area_var[row, :own], 0))
+        ret["height"] = height[row, :own]
+        ret["multiplet"] = g
+        ret["chi2"] = chi2_red[row]
+        ret["converged"] = converged[row]
+        results[i][peek_index] = ret
+
+
+def fit_peeks_batch(items, background="linear", max_iter=100, tol=1e-4, max_peaks=8):
+    """
+    批量拟合多条能谱上的全部峰：重叠的峰归为多重峰一起拟合，
+    所有能谱中峰数相同的多重峰合并为一组同时做 Levenberg-Marquardt 迭代
+
+    :param items: list of PeekFinder 或 (峰列表, MCA/np.ndarray)，峰列表可以是 PeekFinder 或 list of Peek
+    :param background: str, "linear" 线性本底，"step" 线性本底加台阶
+    :param max_iter: int, 最大迭代次数
+    :param tol: float, chi2 相对下降量小于该值时认为收敛
+    :param max_peaks: int, 一个多重峰最多包含的峰数（不含长链切口处加入的相邻峰）
+    :return: list of np.ndarray(FIT_RESULT_DTYPE)，与各能谱的峰一一对应
+    """
+    if background not in BACKGROUNDS:
+        raise ValueError("不支持的本底模型: {}".format(background))
+
+    spectra = []
+    for ele in items:
+        if isinstance(ele, PeekFinder):
+            peeks, data = ele, ele.mca
+        else:
+            peeks, data = ele
+            if data is None:
+                data = peeks.mca
+        if isinstance(data, MCA):
+            data = data.data
+        data = np.asarray(data, dtype=np.float64)
+        peeks = list(peeks)
+
+        positions = np.array([peek.position for peek in peeks], dtype=np.float64)
+        left = np.array([peek.edges[0] for peek in peeks], dtype=np.float64)
+        right = np.array([peek.edges[1] for peek in peeks], dtype=np.float64)
+        sigma = estimate_sigma(data, positions, left, right) if len(peeks) else positions
+        group, lo, hi, chain = group_multiplets(positions, sigma, len(data), max_peaks=max_peaks)
+        spectra.append((data, positions, sigma, group, lo, hi, chain))
+
+    results = [np.zeros(len(ele[1]), dtype=FIT_RESULT_DTYPE) for ele in spectra]
+
+    # 按多重峰的峰数分组，每组补齐到相同点数后一次拟合；
+    # 长链切开处，同链其他段中峰区间与本段拟合区间重叠的峰作为相邻峰加入
+    buckets = {}
+    cut = {}
+    for i, (data, positions, sigma, group, lo, hi, chain) in enumerate(spectra):
+        members = np.argsort(group, kind="stable")
+        bounds = np.searchsorted(group[members], np.arange(len(lo) + 1))
+        reach_lo = positions - 4 * sigma
+        reach_hi = positions + 4 * sigma
+        for g in range(len(lo)):
+            peek_index = members[bounds[g]:bounds[g + 1]]
+            neighbour_index = members[:0]
+            if (chain == chain[g]).sum() > 1:
+                neighbour_index = np.flatnonzero((chain[group] == chain[g]) & (group != g) &
+                                                 (reach_hi >= lo[g]) & (reach_lo <= hi[g]))
+            entry = (i, g, peek_index, neighbour_index)
+            buckets.setdefault(len(peek_index) + len(neighbour_index), []).append(entry)
+            if len(neighbour_index):
+                cut.setdefault(len(peek_index) + len(neighbour_index), []).append(entry)
+
+    # 相邻峰的形状先取寻峰结果，之后各轮取上一轮的拟合结果
+    shapes = []
+    for data, positions, sigma in (ele[:3] for ele in spectra):
+        top = data[np.clip(np.round(positions).astype(np.int64), 0, len(data) - 1)]
+        shapes.append((positions, sigma, np.maximum(top, 1)))
+
+    for npk, bucket in buckets.items():
+        fit_multiplets(spectra, bucket, npk, results, shapes, False, background, max_iter, tol)
+
+    for _ in range(CUT_PASSES if cut else 0):
+        shapes = [(ele["centroid"], ele["fwhm"] / FWHM_FACTOR, ele["height"]) for ele in results]
+        for npk, bucket in cut.items():
+            fit_multiplets(spectra, bucket, npk, results, shapes, True, background, max_iter, tol)
+
+    return results
+
+
+def fit_peeks(peeks, data=None, background="linear", max_iter=100, tol=1e-4, max_peaks=8):
+    """
+    拟合一条能谱上的全部峰
+
+    :param peeks: PeekFinder 或 list of Peek
+    :param data: MCA 或 np.ndarray, peeks 为 PeekFinder 时可省略
+    :param background: str, "linear" 线性本底，"step" 线性本底加台阶
+    :param max_iter: int, 最大迭代次数
+    :param tol: float, chi2 相对下降量小于该值时认为收敛
+    :param max_peaks: int, 一个多重峰最多包含的峰数
+    :return: np.ndarray(FIT_RESULT_DTYPE)，与 peeks 一一对应
+    """
+    return fit_peeks_batch([(peeks, data)], background, max_iter, tol, max_peaks)[0]
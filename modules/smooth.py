@@ -6,9 +6,129 @@
 # Created on: 2021/11/23
 
 import numpy as np
+from math import comb, factorial
+from functools import lru_cache
 from .mca import MCA
 
 
+def mean_filter(data, window_size=3, out=None):
+    """
+    累积和实现的滑动平均，第 window+i 道取 data[i: i+window_size] 的均值，
+    i < len(data)-2*window-1，其余各道保持原值；二维数组沿最后一维逐行计算
+
+    :param data: np.ndarray, 各道计数，一维或 (能谱数, 道数)
+    :param window_size: int, 扫描窗口宽度
+    :param out: np.ndarray(float64), 输出缓冲区，可以就是 data 本身以原地计算，须为浮点类型
+    :return: np.ndarray
+    """
+    window = window_size // 2
+    if out is None:
+        out = np.array(data, dtype=np.float64)
+    elif not np.issubdtype(out.dtype, np.floating):
+        raise TypeError("输出缓冲区须为浮点类型，整数类型会截断均值")
+    elif out is not data:
+        out[:] = data
+
+    length = np.shape(data)[-1]
+    n = length - 2 * window - 1
+    if n <= 0:
+        return out
+
+    cum = np.zeros(np.shape(data)[:-1] + (length + 1,), dtype=np.float64)
+    np.cumsum(data, axis=-1, out=cum[..., 1:])
+    out[..., window: window + n] = (cum[..., window_size: window_size + n] - cum[..., :n]) / window_size
+
+    return out
+
+
+@lru_cache(maxsize=64)
+def binomial_kernel(window_size):
+    """
+    重心法的等效卷积核：window_size 个点两两取平均直到剩一个点，
+    相当于以 C(window_size-1, k) / 2^(window_size-1) 为权重的加权平均
+
+    :param window_size: int, 扫描窗口宽度
+    :return: np.ndarray(float64), 只读
+    """
+    n = window_size - 1
+    ret = np.array([comb(n, k) for k in range(window_size)], dtype=np.float64) / 2.0 ** n
+    ret.flags.writeable = False
+    return ret
+
+
+def binomial_filter(data, window_size=3):
+    """
+    重心法平滑，边界处理与 mean_filter 相同
+
+    :param data: np.ndarray, 各道计数，一维或 (能谱数, 道数)
+    :param window_size: int, 扫描窗口宽度
+    :return: np.ndarray(float64)
+    """
+    window = window_size // 2
+    ret = np.array(data, dtype=np.float64)
+
+    n = ret.shape[-1] - 2 * window - 1
+    if n <= 0:
+        return ret
+
+    windows = np.lib.stride_tricks.sliding_window_view(ret, window_size, axis=-1)
+    ret[..., window: window + n] = windows[..., :n, :] @ binomial_kernel(window_size)
+
+    return ret
+
+
+@lru_cache(maxsize=128)
+def savgol_coeffs(m, order=2, deriv=0):
+    """
+    Savitzky-Golay 系数：对 2m+1 个等距点做 order 次多项式最小二乘拟合，
+    取拟合多项式在中心点处的 deriv 阶导数
+
+    :param m: int, 2m+1为扫描窗口宽度
+    :param order: int, 拟合多项式阶数
+    :param deriv: int, 求导阶数，0为平滑
+    :return: np.ndarray(float64), 依次对应偏移 -m..m 的系数，只读
+    """
+    if order >= 2 * m + 1:
+        raise ValueError("多项式阶数必须小于窗口宽度 2m+1")
+    if deriv > order:
+        raise ValueError("求导阶数不能大于多项式阶数")
+
+    x = np.arange(-m, m + 1, dtype=np.float64)
+    ret = np.linalg.pinv(np.vander(x, order + 1, increasing=True))[deriv] * factorial(deriv)
+    ret.flags.writeable = False
+    return ret
+
+
+def savgol_filter(data, m, h=1, order=2, deriv=0):
+    """
+    Savitzky-Golay 平滑/求导，参与计算的点间距为 h，首尾各 m*h 道保持原值
+
+    :param data: np.ndarray, 各道计数，一维或 (能谱数, 道数)
+    :param m: int, 2m+1为扫描窗口宽度
+    :param h: int, 每个等距点之间的间距
+    :param order: int, 拟合多项式阶数
+    :param deriv: int, 求导阶数，0为平滑（结果小于0时置0）
+    :return: np.ndarray(float64)
+    """
+    ret = np.array(data, dtype=np.float64)
+    width = 2 * m * h + 1
+    length = ret.shape[-1]
+    if m * h <= 0 or length < width:
+        return ret
+
+    # 每行是一个窗口内间距为h的 2m+1 个点，一次矩阵乘法完成全部道的计算
+    windows = np.lib.stride_tricks.sliding_window_view(ret, width, axis=-1)[..., ::h]
+    res = windows @ savgol_coeffs(m, order, deriv)
+    if deriv:
+        res /= h ** deriv
+    else:
+        res[res < 0] = 0
+
+    ret[..., m * h: length - m * h] = res
+
+    return ret
+
+
 class Smoother(MCA):
 
     def __init__(self, data):
@@ -27,13 +147,17 @@ class Mean(Smoother):
     def __init__(self, data):
         super(Mean, self).__init__(data)
 
-    def smooth(self, window_size=3):
-        ret = self.data.copy()
-        window = window_size // 2
-        for i, e in enumerate(self.data[window: -window - 1]):
-            ret[window + i] = np.mean(self.data[i: window_size + i])
-
-        self.data = ret
+    def smooth(self, window_size=3, inplace=False):
+        """
+        :param window_size: int, 扫描窗口宽度
+        :param inplace: bool, 直接在当前数据缓冲区上计算，仅对浮点类型数据生效
+        :return: mca
+        """
+        # 整数类型的缓冲区无法保存均值，退回到复制计算
+        if inplace and isinstance(self.data, np.ndarray) and np.issubdtype(self.data.dtype, np.floating):
+            mean_filter(self.data, window_size, out=self.data)
+        else:
+            self.data = mean_filter(self.data, window_size)
 
         return self.copy()
 
@@ -44,20 +168,7 @@ class BaryCenter(Smoother):
         super(BaryCenter, self).__init__(data)
 
     def smooth(self, window_size=3):
-        ret = self.data.copy()
-        window = window_size // 2
-        for i, e in enumerate(self.data[window: -window - 1]):
-            t1 = self.data[i: window_size + i]
-            t1 = list(t1)
-            t0 = []
-            while len(t1) > 1:
-                for ti, te in enumerate(t1[:-1]):
-                    t0.append((te + t1[ti + 1]) / 2.0)
-                t1 = t0
-                t0 = []
-            ret[window + i] = t1[0]
-
-        self.data = ret
+        self.data = binomial_filter(self.data, window_size)
 
         return self.copy()
 
@@ -67,37 +178,47 @@ class PolynomialLeastSquareMethod(Smoother):
     def __init__(self, data):
         super(PolynomialLeastSquareMethod, self).__init__(data)
 
-        self.__ks = [[0, 0, 0, 0, 0, 0, 0],
-                     [35, 17, 12, -3, 0, 0, 0],
-                     [21, 7, 6, 3, -2, 0, 0],
-                     [231, 59, 54, 39, 14, -21, 0],
-                     [429, 89, 84, 69, 44, 9, -36]
-                     ]
-
-    def smooth(self, m, h):
+    def smooth(self, m, h, order=2, deriv=0):
         """
         :param m: int, 2m+1为扫描窗口宽度
         :param h: int, 每个等距点之间的间距
+        :param order: int, 拟合多项式阶数
+        :param deriv: int, 求导阶数，0为平滑
         :return: mca
         """
-        ret = self.data.copy()
-        ks = self.__ks[m - 1]
+        self.data = savgol_filter(self.data, m, h, order, deriv)
 
-        for i, e in enumerate(self.data[m * h: -m * h]):
-            cal_t = ks[1] * self.data[m * h + i]
+        return self.copy()
 
-            for i2 in range(m):
-                cal_t += self.data[(m - i2 - 1) * h + i] * ks[i2 + 2]
 
-                cal_t += self.data[(m + i2 + 1) * h + i] * ks[i2 + 2]
+BATCH_FILTERS = {
+    "mean": mean_filter,
+    "barycenter": binomial_filter,
+    "polynomial": savgol_filter,
+    Mean: mean_filter,
+    BaryCenter: binomial_filter,
+    PolynomialLeastSquareMethod: savgol_filter,
+}
 
-            cal_t /= ks[0]
 
-            if cal_t < 0:
-                cal_t = 0
+def smooth_batch(spectra, method="mean", **kwargs):
+    """
+    批量平滑，所有能谱沿道方向一次性向量化计算
 
-            ret[m * h + i] = cal_t
+    :param spectra: np.ndarray (能谱数, 道数) 或 list of MCA（道数需一致）
+    :param method: str 或 Smoother 子类, "mean"/"barycenter"/"polynomial" 或 Mean/BaryCenter/PolynomialLeastSquareMethod
+    :param kwargs: 对应平滑方法 smooth() 的参数，如 window_size 或 m, h, order, deriv
+    :return: np.ndarray(float64) (能谱数, 道数)
+    """
+    if method not in BATCH_FILTERS:
+        raise ValueError("不支持的平滑方法: {}".format(method))
 
-        self.data = ret
+    if not isinstance(spectra, np.ndarray):
+        spectra = list(spectra)
+        if len({len(ele) for ele in spectra}) > 1:
+            raise ValueError("各能谱道数不一致")
+        spectra = np.stack([ele.data if isinstance(ele, MCA) else np.asarray(ele) for ele in spectra])
 
-        return self.copy()
+    assert spectra.ndim == 2
+
+    return BATCH_FILTERS[method](spectra, **kwargs)
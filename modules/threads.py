@@ -6,9 +6,11 @@
 # Created on: 2022/2/22
 
 import numpy as np
+import os
 from PyQt5.QtCore import QThread
 from PyQt5.Qt import pyqtSignal
-from .mca import MCA, Pulses
+from .mca import MCA, Pulses, IntervalHistogram, PULSE_BLOCK_SIZE
+from .utils import MinMaxDecimator
 import time
 
 
@@ -25,6 +27,7 @@ class TestThread(QThread):
 
 class PulseGenThread(QThread):
     open_later = pyqtSignal(MCA, str)
+    progress = pyqtSignal('qint64', 'qint64', 'qint64', float)  # 已生成脉冲数, 脉冲总数, 已写入字节数, 预计剩余时间(s)
 
     def __init__(self, parent, filename=None, csp_rate=None,
                  measure_time=None, timed=None,
@@ -38,11 +41,14 @@ class PulseGenThread(QThread):
         self.timed = timed
         self.open_after = open_after
         self.curve = None
+        self.seed = None
+        self.workers = max((os.cpu_count() or 1) - 1, 1)  # 留出一个核心给界面
         self.file_unpack_dict = self.parent.file_unpack_dict
+        self.__t0 = 0
 
     def set_values(self, filename, csp_rate,
                    measure_time, timed,
-                   open_after, curve
+                   open_after, curve, seed=None
                    ):
         self.filename = filename
         self.csp_rate = csp_rate
@@ -50,36 +56,68 @@ class PulseGenThread(QThread):
         self.timed = timed
         self.open_after = open_after
         self.curve = curve
+        self.seed = seed
+
+    def cancel(self):
+        """
+        请求中止生成，当前块写完后停止并删除未完成的文件
+        """
+        self.requestInterruption()
+
+    def static_report(self, done, total, written):
+        elapsed = time.time() - self.__t0
+        eta = elapsed / done * (total - done) if done else 0.0
+        self.progress.emit(done, total, written, eta)
+
+        return not self.isInterruptionRequested()
 
     def run(self):
         self.logger.INFO("[核脉冲模块] 正在生成和脉冲数据，请稍后")
 
         self.parent.flag_pulse_generating = True
+        self.__t0 = time.time()
 
         mca = self.curve
         mca = mca[self.file_unpack_dict["current_mca"]]
         assert isinstance(mca, MCA)
-        if self.timed:
-            pulse = mca.to_timed_pulses(csp_rate=self.csp_rate, total_time=self.total_time)
-        else:
-            pulse = mca.to_pulses(self.csp_rate * self.total_time)
+        mca = mca.copy()
+
+        seed = self.seed
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.logger.DEBUG("[核脉冲模块] 随机种子: {}".format(seed))
 
-        pulse.total_time = self.total_time
         if self.parent.flag_energyX_available:
-            pulse.energyX_a = self.parent.K_energy_a
-            pulse.energyX_b = self.parent.K_energy_b
-        pulse.to_file(self.filename)
+            mca.energyX_a = self.parent.K_energy_a
+            mca.energyX_b = self.parent.K_energy_b
+
+        try:
+            written = mca.to_pulse_file(self.filename,
+                                        csp_rate=self.csp_rate,
+                                        total_time=self.total_time,
+                                        timed=self.timed,
+                                        seed=seed,
+                                        workers=self.workers,
+                                        callback=self.static_report)
+        except Exception as err:
+            self.parent.flag_pulse_generating = False
+            self.logger.ERROR("[核脉冲模块] 核脉冲数据生成失败，{}".format(err))
+            return
+
+        self.parent.flag_pulse_generating = False
+
+        if written is None:
+            self.logger.WARNING("[核脉冲模块] 核脉冲数据生成已中止")
+            return
 
         if self.open_after:
             self.open_later.emit(MCA(self.filename), self.filename)
 
-        self.parent.flag_pulse_generating = False
-
         self.logger.INFO("[核脉冲模块] 核脉冲数据已生成至文件\"{}\"".format(self.filename))
 
 
 class UpdatePulseInfoThread(QThread):
-    draw_pulse = pyqtSignal(tuple)
+    draw_pulse = pyqtSignal(object)  # MinMaxDecimator
     draw_pulse_time = pyqtSignal(tuple)
 
     def __init__(self, parent):
@@ -92,33 +130,39 @@ class UpdatePulseInfoThread(QThread):
         self.curve = None
 
     def static_convert_pulses(self, pulses):
-        x = pulses.get_abs_time()
+        x = pulses.get_abs_time(interrupted=self.isInterruptionRequested)
+        if x is None:
+            return
         y = pulses[:, 0]
 
-        return x, y
+        # 抽稀金字塔在此一次建好，界面线程缩放时只做切片
+        return MinMaxDecimator(x, y)
 
-    def static_convert_time_to_posibility(self, pulses, divs=1000):
+    def static_convert_time_to_posibility(self, pulses, divs=1000, log_scale=False):
         """
 
         :param pulses:
         :param divs:
-        :return: x(毫秒), y概率
+        :param log_scale: bool, 对数等分时间间隔
+        :return: x(毫秒), y概率，被中止时返回None
         """
         assert isinstance(pulses, Pulses)
         times = pulses.data[:, 1]
         assert isinstance(times, np.ndarray)
-        time_p = np.zeros(divs, dtype=np.float64)
-        t_max = times.max()
-        dt = t_max / divs
-        x = np.linspace(0, t_max / 1000, divs)
+        # 范围随各块的最大值增长，不需要先单独遍历一次求最大值
+        hist = IntervalHistogram(None, divs, log_scale)
+        for i in range(0, len(times), PULSE_BLOCK_SIZE):
+            if self.isInterruptionRequested():
+                return
+            hist.update(times[i:i + PULSE_BLOCK_SIZE])
+
+        # 范围翻倍后末尾可能留有空区间，只显示到最后一个非空区间
+        x, y = hist.result()
+        filled = np.flatnonzero(y)
+        if len(filled):
+            x, y = x[:filled[-1] + 1], y[:filled[-1] + 1]
 
-        for i in range(divs):
-            condition_1 = dt * i < times
-            condition_2 = times <= dt * (i + 1)
-            time_p[i] += (condition_1 * condition_2).sum()
-
-        time_p /= time_p.sum()
-        return x, time_p
+        return x, y
 
     def set_curve(self, curve):
         self.curve = curve
@@ -139,8 +183,13 @@ class UpdatePulseInfoThread(QThread):
         self.logger.INFO("[核脉冲模块] 正在绘制核脉冲预览")
 
         # print(avg_time)
+        # 各阶段按块检查中止请求，替代 QThread.terminate()
         self.pulse_data = self.static_convert_pulses(pulse)
+        if self.isInterruptionRequested():
+            return
         self.pulse_time = self.static_convert_time_to_posibility(pulse)
+        if self.isInterruptionRequested():
+            return
 
         self.draw_pulse.emit(self.pulse_data)
         self.draw_pulse_time.emit(self.pulse_time)
@@ -256,6 +256,89 @@ class Mod_PlotWidget(pg.PlotWidget):
         self.post_keyReleaseEvent(ev)
 
 
+class MinMaxDecimator(object):
+
+    def __init__(self, x, y, factor=4, top=1024):
+        """
+        散点图的按像素最小/最大值抽稀，视图范围内每个像素列只保留最低点与最高点。
+        构造时一次性建立最小/最大值金字塔，第k层把相邻 factor**k 个点合并为一组的最小值与最大值，
+        视图变化时只在组数与像素数相当的一层上切片，耗时与数据量无关
+
+        :param x: np.ndarray, 单调递增的横坐标（如脉冲绝对时间）
+        :param y: np.ndarray, 纵坐标（如脉冲道址）
+        :param factor: int, 相邻两层的合并倍数
+        :param top: int, 最顶层的组数不超过该值时停止建层
+        """
+        self.x = x
+        self.y = y
+        self.factor = factor
+        self.levels = []  # [(组大小, 各组最小值, 各组最大值)]
+
+        size = 1
+        y_min = y_max = y
+        while len(y_min) > top:
+            starts = np.arange(0, len(y_min), factor)
+            y_min = np.minimum.reduceat(y_min, starts)
+            y_max = np.maximum.reduceat(y_max, starts)
+            if not self.levels and y_max.max() <= np.iinfo(np.uint16).max and \
+                    np.issubdtype(y_min.dtype, np.integer) and y_min.min() >= 0:
+                # 道址不超过 65535 时以 uint16 保存，金字塔约占原数据的 1/3
+                y_min = y_min.astype(np.uint16)
+                y_max = y_max.astype(np.uint16)
+            size *= factor
+            self.levels.append((size, y_min, y_max))
+
+    def __len__(self):
+        return len(self.x)
+
+    def sample(self, x_min=None, x_max=None, pixels=1000):
+        """
+        按当前视图范围重新抽样
+
+        :param x_min: float, 视图左边界，默认为数据起点
+        :param x_max: float, 视图右边界，默认为数据终点
+        :param pixels: int, 视图宽度（像素）
+        :return: x, y
+        """
+        if not len(self.x):
+            return self.x, self.y
+        if x_min is None:
+            x_min = self.x[0]
+        if x_max is None:
+            x_max = self.x[-1]
+
+        lo = np.searchsorted(self.x, x_min, side="left")
+        hi = np.searchsorted(self.x, x_max, side="right")
+        pixels = max(int(pixels), 1)
+        if hi - lo <= 2 * pixels:
+            return self.x[lo:hi], np.asarray(self.y[lo:hi])
+
+        # 选取视图内组数仍不少于 2*pixels 的最粗一层，每组以首点横坐标参与分列
+        x = self.x[lo:hi]
+        y_min = y_max = np.asarray(self.y[lo:hi])
+        for size, level_min, level_max in self.levels:
+            if (hi - lo) // size < 2 * pixels:
+                break
+            g0 = lo // size
+            g1 = (hi - 1) // size + 1
+            x = self.x[g0 * size:(g1 - 1) * size + 1:size]
+            y_min = level_min[g0:g1]
+            y_max = level_max[g0:g1]
+
+        starts = np.searchsorted(x, np.linspace(x_min, x_max, pixels + 1)[:-1], side="left")
+        starts = np.unique(starts[starts < len(x)])
+
+        y_min = np.minimum.reduceat(y_min, starts)
+        y_max = np.maximum.reduceat(y_max, starts)
+
+        ret_x = np.repeat(x[starts], 2)
+        ret_y = np.empty(len(ret_x), dtype=y_min.dtype)
+        ret_y[0::2] = y_min
+        ret_y[1::2] = y_max
+
+        return ret_x, ret_y
+
+
 def get_R_square(original_plot, current_plot):
     """
     linear_regression with R^2
@@ -390,6 +390,7 @@ class Ui_MainWindow(object):
         self.comboBox_findPeek_algo.setObjectName("comboBox_findPeek_algo")
         self.comboBox_findPeek_algo.addItem("")
         self.comboBox_findPeek_algo.addItem("")
+        self.comboBox_findPeek_algo.addItem("")
         self.horizontalLayout_2.addWidget(self.comboBox_findPeek_algo)
         self.stackedWidget_findPeek = QtWidgets.QStackedWidget(self.page_findPeek)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Maximum, QtWidgets.QSizePolicy.Preferred)
@@ -471,6 +472,39 @@ class Ui_MainWindow(object):
         self.spinBox_findPeek_deri_dots.setObjectName("spinBox_findPeek_deri_dots")
         self.horizontalLayout_9.addWidget(self.spinBox_findPeek_deri_dots)
         self.stackedWidget_findPeek.addWidget(self.page_div)
+        self.page_cwt = QtWidgets.QWidget()
+        self.page_cwt.setObjectName("page_cwt")
+        self.horizontalLayout_10 = QtWidgets.QHBoxLayout(self.page_cwt)
+        self.horizontalLayout_10.setObjectName("horizontalLayout_10")
+        self.label_65 = QtWidgets.QLabel(self.page_cwt)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Maximum, QtWidgets.QSizePolicy.Preferred)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.label_65.sizePolicy().hasHeightForWidth())
+        self.label_65.setSizePolicy(sizePolicy)
+        self.label_65.setObjectName("label_65")
+        self.horizontalLayout_10.addWidget(self.label_65)
+        self.spinBox_findPeek_cwt_width = QtWidgets.QSpinBox(self.page_cwt)
+        self.spinBox_findPeek_cwt_width.setMinimum(2)
+        self.spinBox_findPeek_cwt_width.setMaximum(128)
+        self.spinBox_findPeek_cwt_width.setProperty("value", 16)
+        self.spinBox_findPeek_cwt_width.setObjectName("spinBox_findPeek_cwt_width")
+        self.horizontalLayout_10.addWidget(self.spinBox_findPeek_cwt_width)
+        self.label_66 = QtWidgets.QLabel(self.page_cwt)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Maximum, QtWidgets.QSizePolicy.Preferred)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.label_66.sizePolicy().hasHeightForWidth())
+        self.label_66.setSizePolicy(sizePolicy)
+        self.label_66.setObjectName("label_66")
+        self.horizontalLayout_10.addWidget(self.label_66)
+        self.doubleSpinBox_findPeek_cwt_snr = QtWidgets.QDoubleSpinBox(self.page_cwt)
+        self.doubleSpinBox_findPeek_cwt_snr.setMinimum(1.0)
+        self.doubleSpinBox_findPeek_cwt_snr.setSingleStep(0.5)
+        self.doubleSpinBox_findPeek_cwt_snr.setProperty("value", 5.0)
+        self.doubleSpinBox_findPeek_cwt_snr.setObjectName("doubleSpinBox_findPeek_cwt_snr")
+        self.horizontalLayout_10.addWidget(self.doubleSpinBox_findPeek_cwt_snr)
+        self.stackedWidget_findPeek.addWidget(self.page_cwt)
         self.horizontalLayout_2.addWidget(self.stackedWidget_findPeek)
         self.pushButton_findPeek_yes = QtWidgets.QPushButton(self.page_findPeek)
         self.pushButton_findPeek_yes.setText("")
@@ -1367,12 +1401,17 @@ class Ui_MainWindow(object):
         self.label_2.setText(_translate("MainWindow", "寻峰算法："))
         self.comboBox_findPeek_algo.setItemText(0, _translate("MainWindow", "简单比较法"))
         self.comboBox_findPeek_algo.setItemText(1, _translate("MainWindow", "导数法"))
+        self.comboBox_findPeek_algo.setItemText(2, _translate("MainWindow", "小波变换法"))
         self.label_62.setText(_translate("MainWindow", "寻峰阈值："))
         self.doubleSpinBox_findPeek_sc_K.setToolTip(_translate("MainWindow", "寻峰阈值，一般在1~1.5之间"))
         self.label_63.setText(_translate("MainWindow", "寻峰宽度因子："))
         self.spinBox_findPeek_sc_M.setToolTip(_translate("MainWindow", "寻峰宽度因子，越小寻峰灵敏度越高"))
         self.label_64.setText(_translate("MainWindow", "阶数："))
         self.label_59.setText(_translate("MainWindow", "点数："))
+        self.label_65.setText(_translate("MainWindow", "最大尺度："))
+        self.spinBox_findPeek_cwt_width.setToolTip(_translate("MainWindow", "小波尺度上限（道），约为最宽峰标准差的2.2倍"))
+        self.label_66.setText(_translate("MainWindow", "信噪比："))
+        self.doubleSpinBox_findPeek_cwt_snr.setToolTip(_translate("MainWindow", "最小信噪比，越小寻峰灵敏度越高"))
         self.pushButton_findPeek_yes.setShortcut(_translate("MainWindow", "Return"))
         self.label_25.setText(_translate("MainWindow", "计数率（pps）："))
         self.label_27.setText(_translate("MainWindow", "测量时间（s）："))
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Author: i2cy(i2cy@outlook.com)
+# Project: main.py
+# Filename: test_find_peek
+# Created on: 2026/10/18
+
+from math import factorial
+
+import numpy as np
+import pytest
+
+from modules.mca import MCA
+from modules.find_peek import derivative_kernel, Derivative
+
+# 原导数法系数表 [分母, A0, A1, ...]，一阶、三阶中心对称，二阶轴对称
+LEVEL_TABLE = {
+    (1, 5): [12, 0, 8, -1],
+    (1, 7): [252, 0, 58, 67, -22],
+    (1, 9): [1188, 0, 126, 193, 142, -86],
+    (1, 11): [5148, 0, 296, 503, 532, 294, -300],
+    (2, 5): [7, -2, -1, 2],
+    (2, 7): [42, -4, -3, 0, 5],
+    (2, 9): [462, -20, -17, -8, 7, 28],
+    (2, 11): [429, -10, -9, -6, -1, 6, 15],
+    (3, 5): [2, 0, -2, 1],
+    (3, 7): [6, 0, -1, -1, 1],
+}
+
+LEVELS = (1, 2, 3, 4)
+DOTS = range(5, 102, 2)
+
+
+@pytest.mark.parametrize("level, dots", sorted(LEVEL_TABLE))
+def test_derivative_kernel_matches_table(level, dots):
+    weights, denominator = derivative_kernel(level, dots)
+    row = LEVEL_TABLE[(level, dots)]
+    sign = -1 if level % 2 else 1
+    expected = [sign * ele for ele in row[:1:-1]] + row[1:]
+
+    assert denominator == row[0]
+    assert weights.tolist() == expected
+
+
+@pytest.mark.parametrize("level", LEVELS)
+@pytest.mark.parametrize("dots", DOTS)
+def test_derivative_kernel_moments(level, dots):
+    # 卷积核对 x^k (k <= 拟合阶数) 求得的恰是其在中心点的 level 阶导数
+    weights, denominator = derivative_kernel(level, dots)
+    m = dots // 2
+    for k in range(max(3, level) + 1):
+        moment = sum(int(w) * x ** k for w, x in zip(weights, range(-m, m + 1)))
+        assert moment == (denominator * factorial(level) if k == level else 0)
+
+
+@pytest.mark.parametrize("level", LEVELS)
+@pytest.mark.parametrize("dots", DOTS)
+def test_derivative_search_any_dots(level, dots):
+    x = np.arange(1024)
+    rng = np.random.default_rng(dots * 10 + level)
+    data = rng.poisson(20 + 400 * np.exp(-(x - 300) ** 2 / 50) + 200 * np.exp(-(x - 700) ** 2 / 50))
+    data[450:550] = 20
+    mca = MCA(data.astype(np.float64))
+
+    finder = Derivative(mca, [0, 1023], level, dots)
+    finder.search()
+    deri = finder._Derivative__get_derivatives()
+
+    m = dots // 2
+    assert np.all(deri[450 + m:550 - m] == 0)
+    if level == 1:
+        assert any(abs(peek.peek_location() - 300) < 3 for peek in finder.peeks)
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Author: i2cy(i2cy@outlook.com)
+# Project: main.py
+# Filename: test_mca
+# Created on: 2026/10/18
+
+import numpy as np
+import pytest
+
+from modules.mca import IntervalHistogram, Pulses
+
+
+def reference_counts(times, dt, divs):
+    # 原预览中的逐区间比较 dt*i < t <= dt*(i+1)
+    ret = np.zeros(divs, dtype=np.int64)
+    for i in range(divs):
+        ret[i] = ((dt * i < times) & (times <= dt * (i + 1))).sum()
+    return ret
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_interval_histogram_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    divs = int(rng.integers(7, 1000))
+    times = rng.integers(0, 5000, 20000).astype(np.float64)
+    t_max = times.max()
+    # 恰好落在区间边界上的时间间隔
+    times = np.concatenate([times, (t_max / divs) * np.arange(divs + 1)])
+
+    hist = IntervalHistogram(t_max, divs)
+    for i in range(0, len(times), 3000):
+        hist.update(times[i:i + 3000])
+
+    assert hist.step * divs >= t_max
+    assert np.array_equal(hist.counts, reference_counts(times, hist.step, divs))
+
+
+def test_interval_histogram_grows():
+    hist = IntervalHistogram(100)
+    hist.update([50])
+    hist.update([500])
+
+    assert hist.counts.sum() == 2
+    assert hist.t_max == 800
+    assert np.array_equal(hist.counts, IntervalHistogram(800).update([50, 500]).counts)
+
+
+@pytest.mark.parametrize("log_scale", [False, True])
+def test_interval_histogram_blocks_without_t_max(log_scale):
+    rng = np.random.default_rng(1)
+    times = np.concatenate([rng.integers(0, 100, 5000), rng.integers(0, 100000, 5000)])
+
+    hist = IntervalHistogram(None, 100, log_scale)
+    for i in range(0, len(times), 1000):
+        hist.update(times[i:i + 1000])
+
+    assert hist.counts.sum() == (times > 0).sum()
+    assert hist.t_max >= times.max()
+    expected = IntervalHistogram(None, 100, log_scale)
+    expected._IntervalHistogram__set_step(hist.step)
+    assert np.array_equal(hist.counts, expected.update(times).counts)
+
+
+def timed_pulses():
+    data = np.zeros((1000, 2), dtype=np.uint32)
+    data[:, 0] = np.arange(1000) % 1024
+    data[:, 1] = 1000
+    return Pulses(data)
+
+
+@pytest.mark.parametrize("window", [0, -1.0, np.nan, np.inf])
+def test_to_mca_windows_rejects_window(window):
+    with pytest.raises(ValueError):
+        timed_pulses().to_mca_windows(window=window)
+
+
+@pytest.mark.parametrize("edges", [[], [0.5], [-1, 0.5], [0, 0.5, 0.5], [0, 0.5, 0.2], [0, np.nan]])
+def test_to_mca_windows_rejects_edges(edges):
+    with pytest.raises(ValueError):
+        timed_pulses().to_mca_windows(edges=edges)
+
+
+def test_to_mca_windows_counts():
+    ret = timed_pulses().to_mca_windows(window=0.25)
+    assert len(ret) == 5
+    assert sum(int(ele.sum()) for ele in ret) == 1000
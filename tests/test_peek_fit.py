@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Author: i2cy(i2cy@outlook.com)
+# Project: main.py
+# Filename: test_peek_fit
+# Created on: 2026/10/18
+
+import numpy as np
+import pytest
+
+from modules.mca import MCA
+from modules.find_peek import Peek
+from modules.peek_fit import fit_peeks, group_multiplets
+
+AREAS = np.array([3000, 5000, 2000, 4000, 6000, 3500, 2500, 4500, 3000, 5000, 2000, 4000], dtype=np.float64)
+
+
+def chain_spectrum(spacing, scale=1):
+    """
+    12 个 sigma=3 的峰连成一条链，超过默认 max_peaks=8，拟合时必然被切开
+    """
+    x = np.arange(600, dtype=np.float64)
+    positions = 100 + np.arange(12) * spacing + np.array([0, 1, 0, -1, 0, 2, 0, 1, -1, 0, 1, 0])
+    data = 20 + sum(a * scale / (3 * np.sqrt(2 * np.pi)) * np.exp(-(x - p) ** 2 / 18)
+                    for a, p in zip(AREAS, positions))
+    return positions, data
+
+
+def test_group_multiplets_cuts_at_widest_gap():
+    positions = np.array([10, 20, 30, 40, 55, 65, 75, 85], dtype=np.float64)
+    group, lo, hi, chain = group_multiplets(positions, np.full(8, 3.0), 200, max_peaks=4)
+
+    assert list(group) == [0, 0, 0, 0, 1, 1, 1, 1]
+    assert list(chain) == [0, 0]
+
+
+@pytest.mark.parametrize("spacing", [12, 15])
+def test_fit_long_chain_areas(spacing):
+    positions, data = chain_spectrum(spacing)
+    mca = MCA(data)
+    ret = fit_peeks([Peek(p, (p - 5, p + 5), mca) for p in positions], data)
+
+    assert len(set(ret["multiplet"])) > 1
+    assert np.allclose(ret["area"], AREAS, rtol=1e-3)
+    assert np.allclose(ret["centroid"], positions, atol=1e-2)
+
+
+def test_fit_long_chain_areas_noisy():
+    positions, data = chain_spectrum(12, scale=10)
+    pulls = []
+    for seed in range(10):
+        counts = np.random.default_rng(seed).poisson(data).astype(np.float64)
+        mca = MCA(counts)
+        ret = fit_peeks([Peek(p, (p - 5, p + 5), mca) for p in positions], counts)
+        pulls.append((ret["area"] - AREAS * 10) / ret["area_err"])
+
+    pulls = np.array(pulls)
+    assert np.abs(pulls).max() < 5
+    assert np.abs(pulls.mean(axis=0)).max() < 1.5
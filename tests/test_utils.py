@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Author: i2cy(i2cy@outlook.com)
+# Project: main.py
+# Filename: test_utils
+# Created on: 2026/10/18
+
+import numpy as np
+import pytest
+
+from modules.utils import MinMaxDecimator
+
+
+@pytest.mark.parametrize("lo, hi", [(0, 10 ** 6), (1234, 567890), (1000, 9000), (10, 1500)])
+def test_min_max_decimator_view(lo, hi):
+    rng = np.random.default_rng(lo)
+    x = np.cumsum(rng.exponential(1e-4, 10 ** 6))
+    y = rng.integers(0, 1024, 10 ** 6).astype(np.uint32)
+    decimator = MinMaxDecimator(x, y)
+
+    ret_x, ret_y = decimator.sample(x[lo], x[hi - 1], pixels=500)
+
+    assert len(ret_x) <= 2 * 500
+    assert ret_y.min() == y[lo:hi].min()
+    assert ret_y.max() == y[lo:hi].max()
+    assert np.all(np.diff(ret_x) >= 0)